@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 import json
+from bisect import bisect_right
 from dataclasses import dataclass
 from datetime import time
-from functools import singledispatch
-from itertools import chain, islice, takewhile, zip_longest
+from functools import lru_cache, partial, singledispatch
+from importlib.util import find_spec
+from itertools import takewhile
 from typing import (
     Any,
     Dict,
@@ -21,19 +23,29 @@ from typing import (
     overload,
 )
 
+import aiohttp
 import requests
 from bs4 import BeautifulSoup, ResultSet
 from bs4.element import Tag
 
+import busboy.decoding as decoding
+from busboy.client import shared_client
 from busboy.constants import stop_passage_tdi
 from busboy.model import Route, Stop, StopId, StopPassageResponse, TripId
 from busboy.util import Just, Maybe, Nothing, drop, iterate, unique, unique_justseen
 
 timetable_endpoint = "http://buseireann.ie/inner.php?id=406"
 
+# lxml builds the soup of a timetable page about a fifth faster than Python’s own
+# parser.
+html_parser = "lxml" if find_spec("lxml") is not None else "html.parser"
+
 
 def stops() -> List[Stop]:
-    """Queries the API for the list of all stops."""
+    """Queries the API for the list of all stops.
+
+    This always makes a request; busboy.reference keeps the stored stops loaded.
+    """
     j = from_var(
         requests.get("http://buseireann.ie/inc/proto/bus_stop_points.php").text
     )
@@ -60,8 +72,10 @@ def trips(s: StopId) -> Set[TripId]:
 
 
 def stop_ids() -> Set[str]:
-    """Gets all stop duids from the rest api."""
-    return {s.id for s in stops()}
+    """Gets all stop duids, from the shared reference data."""
+    from busboy.reference import shared_reference_data  # Which imports this.
+
+    return {s.id.raw for s in shared_reference_data().stops()}
 
 
 def routes_at_stop(stop: str) -> Set[str]:
@@ -88,13 +102,8 @@ def routes_at_stops() -> Dict[str, Set[str]]:
 def stop_passage(
     params: Dict[str, str], timeout: Optional[float]
 ) -> StopPassageResponse:
-    if timeout is None:
-        j = requests.get(stop_passage_tdi, params=params, verify=False).json()
-    else:
-        j = requests.get(
-            stop_passage_tdi, params=params, verify=False, timeout=timeout
-        ).json()
-    return StopPassageResponse.from_json(j)
+    body = shared_client().get(stop_passage_tdi, params, timeout)
+    return decoding.stop_passage_response(body)
 
 
 @stop_passage.register
@@ -107,88 +116,198 @@ def sp_trip(t: TripId, timeout: float = 10) -> StopPassageResponse:
     return stop_passage({"trip": t.raw}, timeout)
 
 
+async def stop_passage_async(
+    session: aiohttp.ClientSession, s: StopId, timeout: float = 10
+) -> StopPassageResponse:
+    """Queries a stop using a shared aiohttp session (and its connection pool)."""
+    body = await shared_client().get_async(
+        session, stop_passage_tdi, {"stop_point": s.raw}, timeout
+    )
+    return decoding.stop_passage_response(body)
+
+
+# The last response decoded for each stop, to reuse while its body is unchanged.
+stop_responses: Dict[str, StopPassageResponse] = {}
+
+
+def stop_passage_if_changed(
+    s: StopId, timeout: float = 10
+) -> Tuple[StopPassageResponse, bool]:
+    """Queries a stop, reusing the last response if the body hasn’t changed.
+
+    Also returns whether the last response was reused.
+    """
+    params = {"stop_point": s.raw}
+    client = shared_client()
+    decode = partial(decode_stop_response, s)
+    response = client.get_if_changed(stop_passage_tdi, params, decode, timeout)
+    if response is None:
+        cached = stop_responses.get(s.raw)
+        if cached is not None:
+            return cached, True
+        response = decode(client.get(stop_passage_tdi, params, timeout))
+    return response, False
+
+
+async def stop_passage_if_changed_async(
+    session: aiohttp.ClientSession, s: StopId, timeout: float = 10
+) -> Tuple[StopPassageResponse, bool]:
+    """Like stop_passage_if_changed, but with a shared aiohttp session."""
+    params = {"stop_point": s.raw}
+    client = shared_client()
+    decode = partial(decode_stop_response, s)
+    response = await client.get_if_changed_async(
+        session, stop_passage_tdi, params, decode, timeout
+    )
+    if response is None:
+        cached = stop_responses.get(s.raw)
+        if cached is not None:
+            return cached, True
+        response = decode(
+            await client.get_async(session, stop_passage_tdi, params, timeout)
+        )
+    return response, False
+
+
+def decode_stop_response(s: StopId, body: bytes) -> StopPassageResponse:
+    response = decoding.stop_passage_response(body)
+    stop_responses[s.raw] = response
+    return response
+
+
 def web_timetables(route_name: str) -> Iterable[WebTimetable]:
-    html = requests.get(
-        timetable_endpoint,
-        params={
-            "form-view-timetables-route": route_name,
-            "form-view-timetables-submit": 1,
-        },
-        verify=False,
-    ).text
-    return WebTimetable.from_page(BeautifulSoup(html, features="html.parser"))
+    """The timetables on a route’s page that have columns for the route."""
+    return parse_timetable_page(timetable_page(route_name), route_name)
+
+
+def timetable_page(route_name: str, timeout: Optional[float] = 30) -> bytes:
+    """The HTML of the page of a route’s timetables, undecoded."""
+    params = {
+        "form-view-timetables-route": route_name,
+        "form-view-timetables-submit": "1",
+    }
+    return shared_client().get(timetable_endpoint, params, timeout)
+
+
+def parse_timetable_page(
+    html: Union[str, bytes], route: Optional[str] = None
+) -> Iterable[WebTimetable]:
+    return WebTimetable.from_page(BeautifulSoup(html, features=html_parser), route)
 
 
 def timetables(
-    route_name: str, stops_by_name: Dict[str, Stop]
+    route_name: str, stops_by_name: StopNames
 ) -> Generator[Timetable, None, None]:
+    index = stop_name_index(stops_by_name)
     return (
-        Timetable.from_web_timetable(wt, stops_by_name, route_name)
+        Timetable.from_web_timetable(wt, index, route_name)
         for wt in web_timetables(route_name)
-        if route_name in wt.routes()
     )
 
 
 @dataclass(frozen=True)
 class WebTimetable(object):
-    table: Tag
+    """A timetable from a timetable page, decoded once into a matrix of times.
+
+    Each column is a bus, and each row a stop: times[c][r] is column c’s time at
+    stop_names[r], if it stops there. Rows with fewer cells than the header
+    are padded with Nothing. Rows without a stop name, and columns without a
+    service number, are left out.
+    """
+
+    caption: Optional[str]
+    services: Tuple[str, ...]
+    names: Tuple[str, ...]
+    matrix: Tuple[Tuple[Maybe[time], ...], ...]
 
     @staticmethod
-    def from_page(soup: BeautifulSoup) -> Iterable[WebTimetable]:
+    def from_page(
+        soup: BeautifulSoup, route: Optional[str] = None
+    ) -> Iterable[WebTimetable]:
+        """The timetables on a page, or only those with columns for route.
+
+        Other tables are skipped before being decoded, as are tables without a
+        header row or a body.
+        """
+
         def right_id(i: str) -> bool:
             return i is not None and i.startswith("table-spreadsheet")
 
-        return (WebTimetable(t) for t in soup.find_all(id=right_id))
+        return (
+            WebTimetable.from_table(t)
+            for t in soup.find_all(id=right_id)
+            if t.thead is not None
+            and t.thead.tr is not None
+            and t.tbody is not None
+            and (route is None or route in WebTimetable.table_routes(t))
+        )
 
-    def routes(self) -> Set[str]:
-        return {
-            c.string.strip()
-            for c in self.table.thead.tr("th")
-            if c.string is not None and c.string != "Service Number"
-        }
+    @staticmethod
+    def from_table(table: Tag) -> WebTimetable:
+        services = WebTimetable.table_services(table)
+        names = []
+        rows = []
+        for r in table.tbody("tr"):
+            name = None if r.th is None else " ".join(r.th.get_text().split())
+            if name:
+                names.append(name)
+                rows.append([WebTimetable.cell_time(c) for c in r("td")])
+        width = max([len(services)] + [len(r) for r in rows])
+        for r in rows:
+            r.extend(Nothing() for _ in range(width - len(r)))
+        columns = list(zip(*rows)) if rows else [()] * width
+        kept = [(i, s) for i, s in enumerate(services) if s is not None]
+        caption = None if table.caption is None else table.caption.string
+        return WebTimetable(
+            caption,
+            tuple(s for _, s in kept),
+            tuple(names),
+            tuple(columns[i] for i, _ in kept),
+        )
+
+    @staticmethod
+    def table_services(table: Tag) -> List[Optional[str]]:
+        """The service number heading each column of a table, if it has one."""
+        return [c.string for c in drop(1, table.thead.tr("th"))]
 
-    def stop_names(self) -> Iterable[str]:
-        return (r.th.string for r in self.table.tbody("tr"))
+    @staticmethod
+    def table_routes(table: Tag) -> Set[str]:
+        return {s.strip() for s in WebTimetable.table_services(table) if s is not None}
 
-    def columns(self) -> Iterable[Iterable[Tag]]:
-        rows = (r for r in self.table.tbody("tr"))
-        tds = chain([drop(1, self.table.thead.tr("th"))], (r("td") for r in rows))
-        return zip_longest(*tds)
+    def routes(self) -> Set[str]:
+        return {s.strip() for s in self.services}
 
-    def times(self) -> List[List[Maybe[time]]]:
-        return [[WebTimetable.cell_time(c) for c in cells] for cells in self.columns()]
+    def stop_names(self) -> Tuple[str, ...]:
+        return self.names
 
-    def _times(self) -> Iterable[Iterable[Maybe[time]]]:
-        return ((WebTimetable.cell_time(c) for c in cells) for cells in self.columns())
+    def times(self) -> Tuple[Tuple[Maybe[time], ...], ...]:
+        return self.matrix
 
     def stop_times(self) -> List[List[Tuple[str, Maybe[time]]]]:
-        return [list(zip(self.stop_names(), c)) for c in self._times()]
-
-    def _stop_times(self) -> Iterable[Iterable[Tuple[str, Maybe[time]]]]:
-        return (zip(self.stop_names(), c) for c in self._times())
+        return [list(zip(self.names, c)) for c in self.matrix]
 
     def variants(self) -> Set[Tuple[str, Tuple[str, ...]]]:
         vs = set()
-        for column in self.columns():
-            route = list(islice(column, 1))[0].string
-            v = []
-            for stop, cell in zip(self.stop_names(), drop(1, column)):
-                time = self.cell_time(cell).map(lambda t: True)
-                if time.is_just():
-                    v.append(stop)
+        for route, column in zip(self.services, self.matrix):
+            v = tuple(s for s, t in zip(self.names, column) if isinstance(t, Just))
             if v:
-                vs.add((route, tuple(v)))
+                vs.add((route, v))
         return vs
 
     @staticmethod
     def cell_time(t: Tag) -> Maybe[time]:
-        contents = "".join([s for s in t.stripped_strings])
-        if contents.endswith("[+1]"):
-            contents = contents[:-4]
-        try:
-            return Just(time.fromisoformat(contents))
-        except ValueError:
-            return Nothing()
+        return parse_cell_time("".join(t.stripped_strings))
+
+
+@lru_cache(maxsize=4096)
+def parse_cell_time(contents: str) -> Maybe[time]:
+    """The time in a timetable cell, like "14:05" or "00:10[+1]"."""
+    if contents.endswith("[+1]"):
+        contents = contents[:-4]
+    try:
+        return Just(time.fromisoformat(contents))
+    except ValueError:
+        return Nothing()
 
 
 def tables_by_route(rs: ResultSet) -> List[Dict[str, Any]]:
@@ -217,7 +336,7 @@ def route_stops_to_file(stops):
 
 @dataclass(frozen=True)
 class Timetable(object):
-    caption: str
+    caption: Optional[str]
     variants: Set[TimetableVariant]
 
     def routes(self) -> Set[str]:
@@ -225,16 +344,16 @@ class Timetable(object):
 
     @staticmethod
     def from_web_timetable(
-        wt: WebTimetable, stops_by_name: Dict[str, Stop], route_name: str
+        wt: WebTimetable, stops_by_name: StopNames, route_name: str
     ) -> Timetable:
         tvs = set()
+        index = stop_name_index(stops_by_name)
         for t in wt.variants():
             if t[0] == route_name:
-                stops = tuple(
-                    Maybe.justs(unique_justseen(stops_from_names(t[1], stops_by_name)))
-                )
+                names = stops_from_names(t[1], index)
+                stops = tuple(Maybe.justs(unique_justseen(names)))
                 tvs.add(TimetableVariant(t[0], stops))
-        return Timetable(wt.table.caption.string, tvs)
+        return Timetable(wt.caption, tvs)
 
     @staticmethod
     def unique_variants(ts: Iterable[Timetable]) -> Iterable[TimetableVariant]:
@@ -255,20 +374,96 @@ class TimetableVariant(object):
         return hash(tuple(stop.id for stop in self.stops))
 
 
-def stops_from_names(
-    names: Iterable[str], sbn: Dict[str, Stop]
-) -> Iterable[Maybe[Stop]]:
-    return (match_stop_name(sbn, n) for n in names)
-
-
-def match_stop_name(stops: Dict[str, Stop], name: str) -> Maybe[Stop]:
-    name = name.strip()
-    if name == "Cork Railway Station (Kent)":
-        name = "Kent Rail Station (Horgans Quay)"
-    prefixes: Iterable[str] = chain(
-        [name], takewhile(lambda s: s != "", iterate(lambda s: s[:-1], name))
-    )
-    for p in prefixes:
-        if p in stops:
-            return Just(stops[p])
-    return Nothing()
+def stops_from_names(names: Iterable[str], sbn: StopNames) -> Iterable[Maybe[Stop]]:
+    index = stop_name_index(sbn)
+    return (index.match(n) for n in names)
+
+
+def match_stop_name(stops: StopNames, name: str) -> Maybe[Stop]:
+    return stop_name_index(stops).match(name)
+
+
+# Timetable names for stops whose names in the stops list are too different
+# to match.
+stop_name_aliases = {"Cork Railway Station (Kent)": "Kent Rail Station (Horgans Quay)"}
+
+
+class StopNameIndex(object):
+    """Matches timetable stop names to stops.
+
+    A timetable name matches the stop with the longest name that it starts
+    with, after replacing any alias. Failing that, the names are compared
+    ignoring case, punctuation and spacing.
+    """
+
+    def __init__(
+        self,
+        stops_by_name: Dict[str, Stop],
+        aliases: Dict[str, str] = stop_name_aliases,
+    ) -> None:
+        self.stops = stops_by_name
+        self.names = sorted(stops_by_name)
+        self.aliases = aliases
+        self.loose_stops: Dict[str, Stop] = {}
+        for name, stop in stops_by_name.items():
+            self.loose_stops.setdefault(loose_stop_name(name), stop)
+        self.loose_names = sorted(self.loose_stops)
+
+    def match(self, name: str) -> Maybe[Stop]:
+        name = name.strip()
+        name = self.aliases.get(name, name)
+        if name in self.stops:
+            return Just(self.stops[name])
+        found = longest_prefix(self.names, name)
+        if found is not None:
+            return Just(self.stops[found])
+        found = longest_prefix(self.loose_names, loose_stop_name(name))
+        if found is not None:
+            return Just(self.loose_stops[found])
+        return Nothing()
+
+
+# Stops by name, or an index of them. Building an index sorts every stop name,
+# so pass an index when matching the names of more than one timetable.
+StopNames = Union[Dict[str, Stop], StopNameIndex]
+
+
+def stop_name_index(stops: StopNames) -> StopNameIndex:
+    """The index passed in, or a new index of the stops in a dict."""
+    if isinstance(stops, StopNameIndex):
+        return stops
+    return StopNameIndex(stops)
+
+
+def loose_stop_name(name: str) -> str:
+    """A stop name in lower case, without punctuation or extra spaces."""
+    kept = "".join(c for c in name.casefold() if c.isalnum() or c.isspace())
+    return " ".join(kept.split())
+
+
+def longest_prefix(names: List[str], s: str) -> Optional[str]:
+    """The longest of the sorted names that s starts with (other than "").
+
+    Any name that s starts with sorts between the greatest name up to s and
+    s itself, so is a prefix of both. The search is repeated on their common
+    prefix until a name matches or nothing is left of s.
+    """
+    hi = len(names)
+    while s != "":
+        i = bisect_right(names, s, 0, hi) - 1
+        if i < 0:
+            return None
+        candidate = names[i]
+        if s.startswith(candidate) and candidate != "":
+            return candidate
+        s = s[: common_prefix_length(s, candidate)]
+        hi = i + 1
+    return None
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
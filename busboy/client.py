@@ -0,0 +1,486 @@
+"""An HTTP client for the Bus Éireann API that copes with it being slow or down.
+
+Requests can be rate limited by a token bucket shared by all endpoints. Transient
+errors (connection errors, timeouts, 429 and 5xx responses) are retried after
+a jittered exponential backoff. Each endpoint has a circuit breaker: after
+enough consecutive failures, requests fail immediately with CircuitOpen until
+a single trial request gets through. Request counts, errors and latencies are
+kept per endpoint.
+
+get_if_changed remembers a digest of the last body for each request, along
+with any ETag or Last-Modified headers to make the next request conditional,
+and returns None rather than a body that hasn’t changed. A body is only
+remembered once it has been decoded, so one that fails to decode is decoded
+again when it next comes back.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import random
+from collections import deque
+from dataclasses import dataclass
+from threading import Lock
+from time import monotonic, sleep
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+retry_statuses = {429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+
+class CircuitOpen(Exception):
+    """Raised instead of making a request to an endpoint that keeps failing."""
+
+
+class TransientStatus(Exception):
+    """A response status worth retrying."""
+
+    def __init__(self, status: int) -> None:
+        super().__init__(f"HTTP status {status}")
+        self.status = status
+
+
+sync_transient_errors: Tuple[Type[BaseException], ...] = (
+    requests.ConnectionError,
+    requests.Timeout,
+    TransientStatus,
+)
+async_transient_errors: Tuple[Type[BaseException], ...] = (
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+    asyncio.TimeoutError,
+    TransientStatus,
+)
+
+
+class Fetched(NamedTuple):
+    status: int
+    headers: Mapping[str, str]  # Case insensitive
+    body: bytes
+
+
+@dataclass(frozen=True)
+class Validators(object):
+    """What’s known about the last body returned for a request."""
+
+    digest: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+    def headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+RequestKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def request_key(url: str, params: Dict[str, str]) -> RequestKey:
+    return (url, tuple(sorted(params.items())))
+
+
+def digest(body: bytes) -> bytes:
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+class TokenBucket(object):
+    """Allows rate requests a second on average, in bursts of up to capacity.
+
+    Tokens are reserved rather than waited for under the lock, so callers can
+    sleep (or await) for the returned delay themselves.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def reserve(self) -> float:
+        """Takes a token, returning how many seconds to wait before using it."""
+        with self.lock:
+            now = monotonic()
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class CircuitBreaker(object):
+    """Stops requests to an endpoint after failure_threshold failures in a row.
+
+    Once reset_timeout seconds have passed, one request is let through: if it
+    succeeds the circuit closes again, otherwise it stays open for another
+    reset_timeout.
+    """
+
+    def __init__(self, failure_threshold: int = 10, reset_timeout: float = 30) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.lock = Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == "open":
+                if monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = "half-open"
+                self.trial_in_flight = False
+            if self.state == "half-open":
+                if self.trial_in_flight:
+                    return False
+                self.trial_in_flight = True
+            return True
+
+    def succeeded(self) -> None:
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def failed(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = monotonic()
+            self.trial_in_flight = False
+
+    def abandoned(self) -> None:
+        """Lets another trial through, after one was interrupted without an outcome."""
+        with self.lock:
+            self.trial_in_flight = False
+
+
+@dataclass(frozen=True)
+class EndpointStats(object):
+    requests: int
+    failures: int
+    retries: int
+    rejected: int
+    mean_latency: float
+    p95_latency: float
+    max_latency: float
+    circuit: str
+
+
+class Endpoint(object):
+    """The circuit breaker and counters for one URL."""
+
+    def __init__(self, breaker: CircuitBreaker, latency_window: int = 1000) -> None:
+        self.breaker = breaker
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.latencies: Deque[float] = deque(maxlen=latency_window)
+        self.lock = Lock()
+
+    def record(self, latency: float, failed: bool) -> None:
+        with self.lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.latencies.append(latency)
+            if failed:
+                self.failures += 1
+        if failed:
+            self.breaker.failed()
+        else:
+            self.breaker.succeeded()
+
+    def record_retry(self) -> None:
+        with self.lock:
+            self.retries += 1
+
+    def record_rejected(self) -> None:
+        with self.lock:
+            self.rejected += 1
+
+    def stats(self) -> EndpointStats:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return EndpointStats(
+                requests=self.requests,
+                failures=self.failures,
+                retries=self.retries,
+                rejected=self.rejected,
+                mean_latency=self.total_latency / self.requests
+                if self.requests
+                else 0.0,
+                p95_latency=latencies[int(0.95 * (len(latencies) - 1))]
+                if latencies
+                else 0.0,
+                max_latency=self.max_latency,
+                circuit=self.breaker.state,
+            )
+
+
+class ResilientClient(object):
+    """Makes rate-limited, retried and circuit-broken GET requests.
+
+    Arguments:
+        rate: The average number of requests a second, across all endpoints, or
+            None (the default) not to limit them. A limit also limits polling:
+            a cycle of n stops takes at least (n - burst) / rate seconds.
+        burst: How many requests can be made at once after a quiet spell (by
+            default, rate).
+        retries: How many times to retry a request after a transient error.
+        backoff: The base delay before retrying, in seconds. Each retry waits a
+            random time up to backoff * 2 ** attempt (at most max_backoff).
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        retries: int = 2,
+        backoff: float = 0.5,
+        max_backoff: float = 10,
+        failure_threshold: int = 10,
+        reset_timeout: float = 30,
+        pool_size: int = 300,
+    ) -> None:
+        self.rate = rate
+        self.bucket: Optional[TokenBucket] = None
+        if rate is not None:
+            self.bucket = TokenBucket(rate, rate if burst is None else burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.endpoints: Dict[str, Endpoint] = {}
+        self.endpoints_lock = Lock()
+        self.validators: Dict[RequestKey, Validators] = {}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def endpoint(self, url: str) -> Endpoint:
+        with self.endpoints_lock:
+            if url not in self.endpoints:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self.endpoints[url] = Endpoint(breaker)
+            return self.endpoints[url]
+
+    def stats(self) -> Dict[str, EndpointStats]:
+        with self.endpoints_lock:
+            endpoints = list(self.endpoints.items())
+        return {url: e.stats() for url, e in endpoints}
+
+    def throttle_delay(self) -> float:
+        """How long to wait before the next request, under the rate limit."""
+        return 0 if self.bucket is None else self.bucket.reserve()
+
+    def retry_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def get(
+        self, url: str, params: Dict[str, str], timeout: Optional[float] = None
+    ) -> bytes:
+        """The body of a GET request, after any retries."""
+        return self.fetch(url, params, timeout).body
+
+    def get_if_changed(
+        self,
+        url: str,
+        params: Dict[str, str],
+        decode: Callable[[bytes], T],
+        timeout: Optional[float] = None,
+    ) -> Optional[T]:
+        """The decoded body of a GET request, or None if it’s the same as last time.
+
+        The body is only remembered if decode returns.
+        """
+        key = request_key(url, params)
+        fetched = self.fetch(url, params, timeout, self.conditional_headers(key))
+        return self.decode_if_changed(key, fetched, decode)
+
+    async def get_async(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        params: Dict[str, str],
+        timeout: Optional[float] = None,
+    ) -> bytes:
+        """Like get, but with an aiohttp session."""
+        return (await self.fetch_async(session, url, params, timeout)).body
+
+    async def get_if_changed_async(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        params: Dict[str, str],
+        decode: Callable[[bytes], T],
+        timeout: Optional[float] = None,
+    ) -> Optional[T]:
+        """Like get_if_changed, but with an aiohttp session."""
+        key = request_key(url, params)
+        headers = self.conditional_headers(key)
+        fetched = await self.fetch_async(session, url, params, timeout, headers)
+        return self.decode_if_changed(key, fetched, decode)
+
+    def conditional_headers(self, key: RequestKey) -> Dict[str, str]:
+        validators = self.validators.get(key)
+        return {} if validators is None else validators.headers()
+
+    def decode_if_changed(
+        self, key: RequestKey, fetched: Fetched, decode: Callable[[bytes], T]
+    ) -> Optional[T]:
+        if fetched.status == 304:
+            return None
+        d = digest(fetched.body)
+        last = self.validators.get(key)
+        if last is not None and last.digest == d:
+            return None
+        value = decode(fetched.body)
+        self.validators[key] = Validators(
+            d, fetched.headers.get("ETag"), fetched.headers.get("Last-Modified")
+        )
+        return value
+
+    def fetch(
+        self,
+        url: str,
+        params: Dict[str, str],
+        timeout: Optional[float] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Fetched:
+        """A GET response, after any retries."""
+        endpoint = self.endpoint(url)
+        attempt = 0
+        while True:
+            sleep(self.throttle_delay())
+            if not endpoint.breaker.allow():
+                endpoint.record_rejected()
+                raise CircuitOpen(url)
+            start = monotonic()
+            try:
+                response = self.session.get(
+                    url, params=params, headers=headers, verify=False, timeout=timeout
+                )
+                if response.status_code in retry_statuses:
+                    raise TransientStatus(response.status_code)
+            except sync_transient_errors:
+                endpoint.record(monotonic() - start, failed=True)
+                if attempt >= self.retries:
+                    raise
+                endpoint.record_retry()
+                sleep(self.retry_delay(attempt))
+                attempt += 1
+            except Exception:
+                # Not worth retrying, but the breaker still needs an outcome.
+                endpoint.record(monotonic() - start, failed=True)
+                raise
+            except BaseException:
+                # Interrupted, which says nothing about the endpoint.
+                endpoint.breaker.abandoned()
+                raise
+            else:
+                failed = response.status_code >= 400
+                endpoint.record(monotonic() - start, failed=failed)
+                response.raise_for_status()
+                return Fetched(response.status_code, response.headers, response.content)
+
+    async def fetch_async(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        params: Dict[str, str],
+        timeout: Optional[float] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Fetched:
+        """Like fetch, but with an aiohttp session."""
+        endpoint = self.endpoint(url)
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.throttle_delay())
+            if not endpoint.breaker.allow():
+                endpoint.record_rejected()
+                raise CircuitOpen(url)
+            start = monotonic()
+            try:
+                async with session.get(
+                    url,
+                    params=params,
+                    headers=headers,
+                    ssl=False,
+                    timeout=aiohttp.ClientTimeout(total=timeout),
+                ) as response:
+                    if response.status in retry_statuses:
+                        raise TransientStatus(response.status)
+                    body = await response.read()
+                    fetched = Fetched(response.status, response.headers, body)
+            except async_transient_errors:
+                endpoint.record(monotonic() - start, failed=True)
+                if attempt >= self.retries:
+                    raise
+                endpoint.record_retry()
+                await asyncio.sleep(self.retry_delay(attempt))
+                attempt += 1
+            except asyncio.CancelledError:
+                # Cancelled, which says nothing about the endpoint.
+                endpoint.breaker.abandoned()
+                raise
+            except Exception:
+                # Not worth retrying, but the breaker still needs an outcome.
+                endpoint.record(monotonic() - start, failed=True)
+                raise
+            except BaseException:
+                endpoint.breaker.abandoned()
+                raise
+            else:
+                failed = response.status >= 400
+                endpoint.record(monotonic() - start, failed=failed)
+                response.raise_for_status()
+                return fetched
+
+
+client: Optional[ResilientClient] = None
+client_lock = Lock()
+
+
+def configure_client(c: ResilientClient) -> ResilientClient:
+    """Replaces the shared client."""
+    global client
+    with client_lock:
+        client = c
+        return client
+
+
+def shared_client() -> ResilientClient:
+    """The shared client, created with default settings if needed."""
+    global client
+    with client_lock:
+        if client is None:
+            client = ResilientClient()
+        return client
@@ -1,35 +1,192 @@
 from __future__ import annotations
 
+import atexit
 import datetime as dt
+import io
 import json
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 from dataclasses import InitVar, dataclass, field, fields
 from datetime import date, datetime
-from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union, cast
+from itertools import count
+from pathlib import Path
+from threading import BoundedSemaphore, Lock
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 
 import geopandas as gpd
 import pandas as pd
 import psycopg2 as pp2
 import shapely.geometry as sg
-from psycopg2.extensions import connection, cursor
+from psycopg2.extensions import (
+    TRANSACTION_STATUS_IDLE,
+    TRANSACTION_STATUS_UNKNOWN,
+    connection,
+    cursor,
+)
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 
 import busboy.apis as api
 import busboy.geo as g
 import busboy.model as m
+import busboy.scraping as scraping
 from busboy.apis import Timetable, TimetableVariant
 from busboy.constants import stops_by_route
 from busboy.geo import DegreeLatitude, DegreeLongitude
-from busboy.model import Passage, Route, RouteId, Stop, StopId, TripId
-from busboy.util import Either, Just, Left, Maybe, Nothing, Right
+from busboy.model import AnyPassage, Route, RouteId, Stop, StopId, TripId
+from busboy.util import Either, Just, Left, Maybe, Nothing, Right, dict_collect_list
+
+if TYPE_CHECKING:
+    from busboy.reference import ReferenceData
+
+
+default_dsn = "dbname=busboy user=Noel"
 
 
 def default_connection() -> connection:
-    return pp2.connect("dbname=busboy user=Noel")
+    """Opens a new, unpooled connection; prefer pooled_connection."""
+    return pp2.connect(default_dsn)
 
 
 def test_connection() -> connection:
     return pp2.connect(dbname="busboy-test", user="Noel")
 
 
+class ConnectionPool(object):
+    """A thread-safe pool of database connections.
+
+    Borrowers block while all maxconn connections are in use, rather than
+    opening more. A connection that has been idle for longer than
+    health_check_interval seconds is pinged before it is handed out, and
+    broken connections are discarded and replaced.
+    """
+
+    def __init__(
+        self,
+        dsn: str = default_dsn,
+        minconn: int = 1,
+        maxconn: int = 10,
+        health_check_interval: float = 30,
+    ) -> None:
+        self.pool = ThreadedConnectionPool(minconn, maxconn, dsn)
+        self.available = BoundedSemaphore(maxconn)
+        self.health_check_interval = health_check_interval
+        self.last_used: Dict[int, float] = {}
+
+    @contextmanager
+    def borrow(self) -> Iterator[connection]:
+        with self.available:
+            conn = self.healthy_connection()
+            try:
+                yield conn
+            finally:
+                self.release(conn)
+
+    def healthy_connection(self) -> connection:
+        while True:
+            conn = self.pool.getconn()
+            if self.is_healthy(conn):
+                return conn
+            self.pool.putconn(conn, close=True)
+            self.last_used.pop(id(conn), None)
+
+    def is_healthy(self, conn: connection) -> bool:
+        if conn.closed or conn.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        last_used = self.last_used.get(id(conn))
+        idle = time.monotonic() - last_used if last_used is not None else 0
+        if idle < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cu:
+                cu.execute("select 1")
+            conn.rollback()
+            return True
+        except pp2.Error:
+            return False
+
+    def release(self, conn: connection) -> None:
+        """Returns a connection to the pool, rolling back anything left open."""
+        broken = bool(conn.closed)
+        if not broken and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except pp2.Error:
+                broken = True
+        self.last_used[id(conn)] = time.monotonic()
+        if broken:
+            self.last_used.pop(id(conn), None)
+        self.pool.putconn(conn, close=broken)
+
+    def close(self) -> None:
+        if not self.pool.closed:
+            self.pool.closeall()
+        self.last_used.clear()
+
+
+pool: Optional[ConnectionPool] = None
+pool_lock = Lock()
+
+
+def configure_pool(
+    dsn: str = default_dsn,
+    minconn: int = 1,
+    maxconn: int = 10,
+    health_check_interval: float = 30,
+) -> ConnectionPool:
+    """Replaces the shared connection pool, closing the old one."""
+    global pool
+    with pool_lock:
+        if pool is not None:
+            pool.close()
+        pool = ConnectionPool(dsn, minconn, maxconn, health_check_interval)
+        return pool
+
+
+def shared_pool() -> ConnectionPool:
+    """The shared connection pool, created with default settings if needed."""
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ConnectionPool()
+        return pool
+
+
+@atexit.register
+def close_pool() -> None:
+    global pool
+    with pool_lock:
+        if pool is not None:
+            pool.close()
+            pool = None
+
+
+@contextmanager
+def pooled_connection(c: Optional[connection] = None) -> Iterator[connection]:
+    """Yields c if given, otherwise a connection borrowed from the shared pool.
+
+    A borrowed connection is returned to the pool when the block exits.
+    """
+    if c is not None:
+        yield c
+    else:
+        with shared_pool().borrow() as conn:
+            yield conn
+
+
 def snapshots(
     connection: Optional[connection] = None,
     r: Optional[m.RouteId] = None,
@@ -37,41 +194,123 @@ def snapshots(
     date_span: Optional[Tuple[date, date]] = None,
 ) -> List[BusSnapshot]:
     """Gets entries from the database, optionally filtering by route or date."""
-    if connection is None:
-        connection = default_connection()
-    with connection.cursor() as cu:
-        query = b"select * from passage_responses"
-        conditions: List[bytes] = []
-        if r is not None:
-            conditions.append(cu.mogrify(" route_id = %s", (r.raw,)))
-        if d is not None or date_span is not None:
-            if date_span is not None:
-                dt1, dt2 = day_span(list(date_span))
-            elif d is not None:
-                dt1, dt2 = day_span([d])
-
-            conditions.append(
-                cu.mogrify(" last_modified between %s and %s", (dt1, dt2))
-            )
-        if conditions != []:
-            query += b" where" + b" and".join(conditions)
-        cu.execute(query)
+    with pooled_connection(connection) as conn, conn.cursor() as cu:
+        cu.execute(snapshots_query(cu, r, d, date_span))
         return [BusSnapshot.from_db_row(row) for row in cu.fetchall()]
 
 
+def iter_snapshots(
+    connection: Optional[connection] = None,
+    r: Optional[m.RouteId] = None,
+    d: Optional[date] = None,
+    date_span: Optional[Tuple[date, date]] = None,
+    by_vehicle: bool = False,
+    itersize: int = 10_000,
+) -> Iterator[BusSnapshot]:
+    """Like snapshots, but streams them lazily from a server-side cursor.
+
+    With by_vehicle, each vehicle’s snapshots arrive together, in poll order.
+    """
+    for chunk in snapshot_chunks(connection, r, d, date_span, by_vehicle, itersize):
+        yield from chunk
+
+
+snapshot_cursor_ids = count()
+
+
+def snapshot_chunks(
+    connection: Optional[connection] = None,
+    r: Optional[m.RouteId] = None,
+    d: Optional[date] = None,
+    date_span: Optional[Tuple[date, date]] = None,
+    by_vehicle: bool = False,
+    itersize: int = 10_000,
+) -> Iterator[List[BusSnapshot]]:
+    """Streams snapshots in lists of at most itersize, using a named cursor.
+
+    Only one chunk of rows is held in memory at a time. The connection stays
+    in a transaction until the iterator is exhausted or closed.
+    """
+    with pooled_connection(connection) as conn, conn:
+        name = f"snapshots_{next(snapshot_cursor_ids)}"
+        with conn.cursor(name=name) as cu:
+            cu.itersize = itersize
+            order = b" order by vehicle_id, poll_time" if by_vehicle else b""
+            cu.execute(snapshots_query(cu, r, d, date_span) + order)
+            while True:
+                rows = cu.fetchmany(itersize)
+                if rows == []:
+                    break
+                yield [BusSnapshot.from_db_row(row) for row in rows]
+
+
+def snapshots_query(
+    cu: cursor,
+    r: Optional[m.RouteId] = None,
+    d: Optional[date] = None,
+    date_span: Optional[Tuple[date, date]] = None,
+    columns: bytes = b"*",
+) -> bytes:
+    query = b"select " + columns + b" from passage_responses"
+    conditions: List[bytes] = []
+    if r is not None:
+        conditions.append(cu.mogrify(" route_id = %s", (r.raw,)))
+    if d is not None or date_span is not None:
+        if date_span is not None:
+            dt1, dt2 = day_span(list(date_span))
+        elif d is not None:
+            dt1, dt2 = day_span([d])
+
+        conditions.append(cu.mogrify(" last_modified between %s and %s", (dt1, dt2)))
+    if conditions != []:
+        query += b" where" + b" and".join(conditions)
+    return query
+
+
+# Timestamps are formatted explicitly so that every row parses the same way
+# (postgres drops the fractional seconds when they are zero).
+snapshot_columns = b"""
+    to_char(last_modified, 'YYYY-MM-DD HH24:MI:SS.US') as last_modified,
+    trip_id as trip, route_id as route, vehicle_id as vehicle,
+    pattern_id as pattern, latitude, longitude, bearing, is_accessible,
+    has_bike_rack, direction, congestion_level, accuracy_level, status, category,
+    to_char(poll_time, 'YYYY-MM-DD HH24:MI:SS.US') as poll_time
+"""
+
+
 def snapshots_df(
     connection: Optional[connection] = None,
     route: Optional[m.RouteId] = None,
     day: Optional[date] = None,
     date_span: Optional[Tuple[date, date]] = None,
 ) -> pd.DataFrame:
-    df = snapshots(connection, route, day, date_span)
-    return pd.DataFrame(map(lambda s: s.as_dict(), df))
+    """The snapshots, read straight into typed columns.
+
+    The query result is copied out of the database as CSV and parsed by pandas,
+    so no per-row Python objects are built. Identifiers are plain strings rather
+    than id wrappers, and there is no point column.
+    """
+    with pooled_connection(connection) as conn, conn.cursor() as cu:
+        query = snapshots_query(cu, route, day, date_span, snapshot_columns)
+        buffer = io.StringIO()
+        cu.copy_expert(f"copy ({query.decode()}) to stdout with csv header", buffer)
+    buffer.seek(0)
+    df = pd.read_csv(
+        buffer,
+        dtype={"trip": str, "route": str, "vehicle": str, "pattern": str},
+        true_values=["t"],
+        false_values=["f"],
+    )
+    for column in ["last_modified", "poll_time"]:
+        df[column] = pd.to_datetime(df[column], format="%Y-%m-%d %H:%M:%S.%f")
+    df["latitude"] = df["latitude"] / 3_600_000
+    df["longitude"] = df["longitude"] / 3_600_000
+    return df
 
 
 def poll_times_df(connection: Maybe[connection] = Nothing(),) -> pd.DataFrame:
-    with connection.or_else_lazy(default_connection) as connection:
-        with connection.cursor() as cursor:
+    with pooled_connection(connection.optional()) as conn, conn:
+        with conn.cursor() as cursor:
             cursor.execute(
                 "select distinct poll_time from passage_responses order by poll_time asc"
             )
@@ -93,9 +332,7 @@ def data_gdf(
 
 
 def store_route(r: Route, conn: Optional[connection] = None) -> Optional[Exception]:
-    if conn is None:
-        conn = default_connection()
-    with conn:
+    with pooled_connection(conn) as conn, conn:
         with conn.cursor() as cursor:
             try:
                 cursor.execute(
@@ -114,9 +351,7 @@ def store_route(r: Route, conn: Optional[connection] = None) -> Optional[Excepti
 
 
 def store_stop(r: Stop, conn: Optional[connection] = None) -> None:
-    if conn is None:
-        conn = default_connection()
-    with conn:
+    with pooled_connection(conn) as conn, conn:
         with conn.cursor() as cursor:
             cursor.execute(
                 """
@@ -130,16 +365,11 @@ def store_stop(r: Stop, conn: Optional[connection] = None) -> None:
 
 
 def store_trip(
-    p: Passage, poll_time: dt.datetime, connection: Optional[connection] = None
+    p: AnyPassage, poll_time: dt.datetime, connection: Optional[connection] = None
 ) -> Optional[Exception]:
-    if connection is None:
-        try:
-            connection = default_connection()
-        except Exception as e:
-            return e
-    with connection:
-        try:
-            with connection.cursor() as cursor:
+    try:
+        with pooled_connection(connection) as conn, conn:
+            with conn.cursor() as cursor:
                 cursor.execute(
                     """
                     insert into passage_responses(
@@ -152,85 +382,207 @@ def store_trip(
                         %s, %s, %s, %s, %s,
                         %s, %s, %s, %s, %s, %s)
                     """,
-                    [
-                        p.last_modified,
-                        p.trip,
-                        p.route,
-                        p.vehicle,
-                        p.pattern,
-                        p.latitude,
-                        p.longitude,
-                        p.bearing,
-                        p.is_accessible,
-                        p.has_bike_rack,
-                        p.direction,
-                        p.congestion,
-                        p.accuracy,
-                        p.status,
-                        p.category,
-                        poll_time,
-                    ],
+                    passage_row(p, poll_time),
                 )
                 return None
-        except Exception as e:
-            return e
+    except Exception as e:
+        return e
+
+
+PassageKey = Tuple[str, datetime]
+
+
+@dataclass(frozen=True)
+class StoreResult(object):
+    """The outcome of storing a batch of passages."""
+
+    inserted: int
+    conflicts: List[PassageKey]
+    missing_key: int
+
+
+def store_trips(
+    passages: Iterable[AnyPassage], poll_time: dt.datetime, connection: connection
+) -> StoreResult:
+    """Stores a batch of passages in a single transaction.
+
+    Passages whose (trip_id, last_modified) key is already in the database, or
+    appears more than once in the batch, are not inserted; their keys are
+    returned as conflicts. Passages without a trip or last-modified time can’t
+    be stored at all and are only counted.
+    """
+    rows = []
+    missing_key = 0
+    for p in passages:
+        row = passage_row(p, poll_time)
+        if row[0] is None or row[1] is None:
+            missing_key += 1
+        else:
+            rows.append(row)
+    if rows == []:
+        return StoreResult(0, [], missing_key)
+    with connection:
+        with connection.cursor() as cursor:
+            # One page, so that returning gives us every inserted row.
+            execute_values(
+                cursor,
+                """
+                insert into passage_responses(
+                    last_modified, trip_id, route_id, vehicle_id, pattern_id,
+                    latitude, longitude, bearing, is_accessible, has_bike_rack,
+                    direction, congestion_level, accuracy_level, status, category,
+                    poll_time
+                ) values %s
+                on conflict (trip_id, last_modified) do nothing
+                returning trip_id, last_modified
+                """,
+                rows,
+                page_size=len(rows),
+            )
+            inserted = Counter((r[0], r[1]) for r in cursor.fetchall())
+    conflicts = []
+    for row in rows:
+        key = (cast(str, row[1]), cast(datetime, row[0]))
+        if inserted[key] > 0:
+            inserted[key] -= 1
+        else:
+            conflicts.append(key)
+    return StoreResult(len(rows) - len(conflicts), conflicts, missing_key)
+
+
+def passage_key(p: AnyPassage) -> Optional[PassageKey]:
+    """The (trip_id, last_modified) primary key p would be stored under."""
+    if isinstance(p.trip, Just) and isinstance(p.last_modified, Just):
+        return (p.trip.value.raw, p.last_modified.value)
+    else:
+        return None
+
 
+def passage_row(p: AnyPassage, poll_time: dt.datetime) -> List[Any]:
+    """The values of a passage_responses row, in the order store_trip uses.
+
+    CompactPassage.fingerprint holds the same fields, to spot changes to them.
+    """
+    return [
+        p.last_modified.optional(),
+        p.trip.map(lambda i: i.raw).optional(),
+        p.route.map(lambda i: i.raw).optional(),
+        p.vehicle.map(lambda i: i.raw).optional(),
+        p.pattern.map(lambda i: i.raw).optional(),
+        p.latitude.optional(),
+        p.longitude.optional(),
+        p.bearing.optional(),
+        p.is_accessible.optional(),
+        p.has_bike_rack.optional(),
+        p.direction.optional(),
+        p.congestion.optional(),
+        p.accuracy.optional(),
+        p.status.optional(),
+        p.category.optional(),
+        poll_time,
+    ]
+
+
+def store_timetables(
+    max_workers: int = 8,
+    cache: Optional[scraping.PageCache] = None,
+    force: bool = False,
+) -> None:
+    """Scrapes and stores the timetables of every route whose page has changed.
 
-def store_timetables() -> None:
-    sbn = stops_by_name()
-    rbn = routes_by_name()
-    conn = default_connection()
-    for route in stops_by_route:
-        for timetable in api.timetables(route, sbn):
-            store_timetable(timetable, rbn[route].id, conn)
+    Up to max_workers pages are fetched at once. A changed route’s timetables
+    replace those stored for it before.
+    """
+    reference = reference_data()
+    sbn = reference.stop_name_index()
+    rbn = reference.routes_by_name()
+    cache = scraping.PageCache() if cache is None else cache
+    pages = scraping.scrape(stops_by_route, sbn, cache, max_workers, force)
+    with pooled_connection() as conn:
+        for page in pages:
+            replace_route_timetables(page.timetables, rbn[page.route].id, conn)
+            cache.stored(page)
+            print(f"Stored {len(page.timetables)} timetables for route {page.route}.")
+
+
+def replace_route_timetables(
+    timetables: Iterable[Timetable], route: RouteId, conn: Optional[connection] = None
+) -> None:
+    """Replaces a route’s timetables in one transaction."""
+    with pooled_connection(conn) as conn, conn:
+        with conn.cursor() as cursor:
+            delete_route_timetables(cursor, route)
+            for timetable in timetables:
+                insert_timetable(cursor, timetable, route)
 
 
 def store_timetable(
     timetable: Timetable, route: RouteId, conn: Optional[connection] = None
 ) -> None:
-    if conn is None:
-        conn = default_connection()
-    with conn:
+    with pooled_connection(conn) as conn, conn:
         with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                insert into timetables (caption) values (%s) returning id
-                """,
-                [timetable.caption],
-            )
-            row = cast(Tuple[Any, ...], cursor.fetchone())
-            timetable_id = row[0]
-            cursor.execute(
-                """
-                insert into route_timetables (route, timetable)
-                values (%s, %s)
-                """,
-                [route.raw, timetable_id],
-            )
-            for variant in timetable.variants:
-                cursor.execute(
-                    """
-                    insert into timetable_variants (route_name, timetable_id)
-                    values (%s, %s) returning id
-                    """,
-                    [variant.route.strip(), timetable_id],
-                )
-                variant_id = cast(Tuple[Any, ...], cursor.fetchone())[0]
-                for position, stop in enumerate(variant.stops):
-                    cursor.execute(
-                        """
-                        insert into variant_stops (position, variant, stop)
-                        values (%s, %s, %s)
-                        """,
-                        [position, variant_id, stop.id.raw],
-                    )
+            insert_timetable(cursor, timetable, route)
+
+
+def insert_timetable(cursor: cursor, timetable: Timetable, route: RouteId) -> None:
+    cursor.execute(
+        """
+        insert into timetables (caption) values (%s) returning id
+        """,
+        [timetable.caption],
+    )
+    row = cast(Tuple[Any, ...], cursor.fetchone())
+    timetable_id = row[0]
+    cursor.execute(
+        """
+        insert into route_timetables (route, timetable)
+        values (%s, %s)
+        """,
+        [route.raw, timetable_id],
+    )
+    for variant in timetable.variants:
+        cursor.execute(
+            """
+            insert into timetable_variants (route_name, timetable_id)
+            values (%s, %s) returning id
+            """,
+            [variant.route.strip(), timetable_id],
+        )
+        variant_id = cast(Tuple[Any, ...], cursor.fetchone())[0]
+        execute_values(
+            cursor,
+            "insert into variant_stops (position, variant, stop) values %s",
+            [
+                (position, variant_id, stop.id.raw)
+                for position, stop in enumerate(variant.stops)
+            ],
+        )
+
+
+def delete_route_timetables(cursor: cursor, route: RouteId) -> None:
+    cursor.execute(
+        "delete from route_timetables where route = %s returning timetable", [route.raw]
+    )
+    timetable_ids = [timetable_id for (timetable_id,) in cursor.fetchall()]
+    cursor.execute(
+        """
+        delete from variant_stops where variant in (
+            select id from timetable_variants where timetable_id = any(%s)
+        )
+        """,
+        [timetable_ids],
+    )
+    cursor.execute(
+        "delete from timetable_variants where timetable_id = any(%s)", [timetable_ids]
+    )
+    cursor.execute("delete from timetables where id = any(%s)", [timetable_ids])
 
 
 def timetables(
     route: RouteId, connection: Maybe[connection] = Nothing()
 ) -> Iterator[Either[str, Timetable]]:
     """Gets the timetables for a specific route from the database."""
-    with connection.or_else_lazy(default_connection) as conn:
+    with pooled_connection(connection.optional()) as conn, conn:
         with conn.cursor() as cursor:
             cursor.execute(
                 """
@@ -239,74 +591,118 @@ def timetables(
                 """,
                 [route.raw],
             )
-            for (timetable_id,) in cursor.fetchall():
-                yield timetable(timetable_id, Just(conn))
+            timetable_ids = [timetable_id for (timetable_id,) in cursor.fetchall()]
+        loaded = load_timetables(conn, timetable_ids)
+    for timetable_id in timetable_ids:
+        yield loaded[timetable_id]
 
 
 def timetable(
     timetable_id: int, connection: Maybe[connection] = Nothing()
 ) -> Either[str, Timetable]:
-    with connection.or_else_lazy(default_connection) as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                select caption from timetables
-                where id = %s
-                """,
-                [timetable_id],
-            )
-            result = cursor.fetchone()
-            if result is None:
-                return Left(f"Timetable {timetable_id} not in database")
-            caption = result[0]
-            cursor.execute(
-                """
-                select id from timetable_variants
-                where timetable_id = %s
-                """,
-                [timetable_id],
-            )
-            variants = (
-                timetable_variant(id, Just(conn)) for (id,) in cursor.fetchall()
-            )
-            return Right(
-                Timetable(caption, {v.value for v in variants if isinstance(v, Right)})
-            )
+    with pooled_connection(connection.optional()) as conn, conn:
+        return load_timetables(conn, [timetable_id])[timetable_id]
 
 
 def timetable_variant(
     variant_id: int, connection: Maybe[connection] = Nothing()
 ) -> Either[str, TimetableVariant]:
-    with connection.or_else_lazy(default_connection) as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                select route_name from timetable_variants
-                where id = %s
-                """,
-                [variant_id],
+    with pooled_connection(connection.optional()) as conn, conn:
+        return load_variants(conn, [variant_id])[variant_id]
+
+
+def load_timetables(
+    conn: connection, timetable_ids: List[int]
+) -> Dict[int, Either[str, Timetable]]:
+    """Loads timetables with their variants and stops, in four queries in all.
+
+    As with timetable_variant, variants with a stop missing from the stops
+    table are left out.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            select id, caption from timetables
+            where id = any(%s)
+            """,
+            [timetable_ids],
+        )
+        captions: Dict[int, Optional[str]] = dict(cursor.fetchall())
+        cursor.execute(
+            """
+            select timetable_id, id from timetable_variants
+            where timetable_id = any(%s)
+            """,
+            [timetable_ids],
+        )
+        variant_ids = dict_collect_list(cursor.fetchall(), key=lambda row: row[0])
+    variants = load_variants(conn, [v for vs in variant_ids.values() for _, v in vs])
+    output: Dict[int, Either[str, Timetable]] = {}
+    for timetable_id in timetable_ids:
+        if timetable_id not in captions:
+            output[timetable_id] = Left(f"Timetable {timetable_id} not in database")
+            continue
+        timetable_variants = (variants[v] for _, v in variant_ids.get(timetable_id, []))
+        output[timetable_id] = Right(
+            Timetable(
+                captions[timetable_id],
+                {v.value for v in timetable_variants if isinstance(v, Right)},
             )
-            variant_row = cursor.fetchone()
-            if variant_row is None:
-                return Left(f"Variant {variant_id} not in database")
-            route_name = variant_row[0]
-            cursor.execute(
-                """
-                select stop from variant_stops
-                where variant = %s
-                order by position asc
-                """,
-                [variant_id],
+        )
+    return output
+
+
+def load_variants(
+    conn: connection, variant_ids: List[int]
+) -> Dict[int, Either[str, TimetableVariant]]:
+    """Loads timetable variants with their stops, in two queries.
+
+    Stops shared between variants are the same Stop objects.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            select id, route_name from timetable_variants
+            where id = any(%s)
+            """,
+            [variant_ids],
+        )
+        route_names: Dict[int, str] = dict(cursor.fetchall())
+        cursor.execute(
+            """
+            select vs.variant, s.* from variant_stops as vs
+            left join stops as s on s.id = vs.stop
+            where vs.variant = any(%s)
+            order by vs.variant, vs.position asc
+            """,
+            [variant_ids],
+        )
+        rows = cursor.fetchall()
+    stops: Dict[str, Stop] = {}
+    variant_stops: Dict[int, List[Optional[Stop]]] = defaultdict(list)
+    for row in rows:
+        stop_row = row[1:]
+        if stop_row[0] is None:
+            variant_stops[row[0]].append(None)
+        else:
+            if stop_row[0] not in stops:
+                stops[stop_row[0]] = Stop.from_db_row(stop_row)
+            variant_stops[row[0]].append(stops[stop_row[0]])
+    output: Dict[int, Either[str, TimetableVariant]] = {}
+    for variant_id in variant_ids:
+        if variant_id not in route_names:
+            output[variant_id] = Left(f"Variant {variant_id} not in database")
+            continue
+        vs = variant_stops.get(variant_id, [])
+        if any(s is None for s in vs):
+            output[variant_id] = Left(
+                "Error in database, stop in variant_stops but not in stops"
             )
-            stop_ids = (stop for (stop,) in cursor.fetchall())
-            stops = tuple(stop_by_id(conn, StopId(s)) for s in stop_ids)
-            if all(map(lambda s: isinstance(s, Just), stops)):
-                just_stops = cast(Tuple[Just[Stop], ...], stops)
-                return Right(
-                    TimetableVariant(route_name, tuple(s.value for s in just_stops))
-                )
-            else:
-                return Left("Error in database, stop in variant_stops but not in stops")
+        else:
+            output[variant_id] = Right(
+                TimetableVariant(route_names[variant_id], tuple(cast(List[Stop], vs)))
+            )
+    return output
 
 
 def test_database() -> None:
@@ -321,22 +717,33 @@ def test_database() -> None:
             )
 
 
-def routes() -> List[Route]:
-    j = json.load(
-        open(
-            "/Users/Noel/Developer/Projects/Busboy/resources/example-responses/routes.json"
-        )
-    )
+example_responses = Path(__file__).parent.parent / "resources" / "example-responses"
+routes_path = example_responses / "routes.json"
+
+
+def routes(path: Path = routes_path) -> List[Route]:
+    """Reads the routes saved from the API; see also busboy.reference."""
+    with open(path) as f:
+        j = json.load(f)
     rs = j["routeTdi"]
     return [Route.from_json(r) for k, r in rs.items() if k != "foo"]
 
 
+def reference_data() -> ReferenceData:
+    # Imported here, since busboy.reference loads its data with this module.
+    from busboy.reference import shared_reference_data
+
+    return shared_reference_data()
+
+
 def routes_by_name() -> Dict[str, Route]:
-    return {r.name: r for r in routes()}
+    """The routes by name, from the shared reference data."""
+    return reference_data().routes_by_name()
 
 
 def routes_by_id() -> Dict[m.RouteId, Route]:
-    return {r.id: r for r in routes()}
+    """The routes by id, from the shared reference data."""
+    return reference_data().routes_by_id()
 
 
 def trip_points(connection: connection, t: TripId) -> TripPoints:
@@ -424,7 +831,7 @@ class BusSnapshot(object):
         return {f.name: self.__dict__[f.name] for f in fields(self)}
 
     @staticmethod
-    def from_passage(passage: Passage, time: datetime) -> BusSnapshot:
+    def from_passage(passage: AnyPassage, time: datetime) -> BusSnapshot:
         longitude = passage.longitude.map(lambda l: l / 3_600_000)
         latitude = passage.latitude.map(lambda l: l / 3_600_000)
         point = longitude.bind(lambda lon: latitude.map(lambda lat: sg.Point(lat, lon)))
@@ -497,7 +904,7 @@ def stops_by_route_name(c: connection, route: str) -> List[m.Stop]:
 
 
 def stop_by_name(name: str) -> Optional[Stop]:
-    with open("resources/example-responses/busStopPoints.json") as f:
+    with open(example_responses / "busStopPoints.json") as f:
         j = json.load(f)
         for k, bs in j["bus_stops"].items():
             if bs["name"] == name:
@@ -519,12 +926,13 @@ def stop_by_id(c: connection, s: m.StopId) -> Maybe[Stop]:
 
 def stops(c: Optional[connection] = None) -> List[Stop]:
     """Retrieves a list of all stops from the database."""
-    if c is None:
-        c = default_connection()
-    with c.cursor() as cu:
+    with pooled_connection(c) as conn, conn.cursor() as cu:
         cu.execute("select * from stops")
         return [Stop.from_db_row(r) for r in cu.fetchall()]
 
 
 def stops_by_name(c: Optional[connection] = None) -> Dict[str, Stop]:
-    return {s.name: s for s in stops(c)}
+    """The stops by name: from c if given, else from the shared reference data."""
+    if c is not None:
+        return {s.name: s for s in stops(c)}
+    return reference_data().stops_by_name()
@@ -0,0 +1,162 @@
+"""Fast decoding of stop passage responses.
+
+StopPassageResponse.from_json builds every field through chains of Maybe
+lambdas and a new time zone per timestamp. The functions here read the same
+payload with plain dict lookups and precomputed constants, into CompactPassages
+holding equal values.
+
+Run as a script to check the two decoders agree on saved responses (by
+default, every stop passage response in resources/example-responses), as
+precommit.fish does:
+
+    python -m busboy.decoding [response.json ...]
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from sys import argv
+from typing import Any, Dict, List, Optional, Tuple, Union, cast
+
+import busboy.model as m
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads  # type: ignore
+
+example_responses = Path(__file__).parent.parent / "resources" / "example-responses"
+
+# from_json reads timestamps as UTC+1, then drops the time zone.
+utc_plus_one = timezone(timedelta(hours=1))
+epoch = datetime(1970, 1, 1, 1)
+
+
+def stop_passage_response(body: Union[bytes, str]) -> m.StopPassageResponse:
+    """Decodes the body of a stop passage response."""
+    return stop_passage_response_from_json(loads(body))
+
+
+def stop_passage_response_from_json(j: Dict[str, Any]) -> m.StopPassageResponse:
+    return m.StopPassageResponse(
+        tuple(passage(pj) for k, pj in j["stopPassageTdi"].items() if k != "foo")
+    )
+
+
+def passage(j: Dict[str, Any]) -> m.CompactPassage:
+    get = j.get
+    last_modified = get("last_modification_timestamp")
+    is_accessible = get("is_accessible")
+    has_bike_rack = get("has_bike_rack")
+    return m.CompactPassage(
+        m.PassageValues(
+            id=get("duid"),
+            last_modified=None
+            if last_modified is None
+            else from_milliseconds(last_modified),
+            trip=duid(get("trip_duid")),
+            route=duid(get("route_duid")),
+            vehicle=duid(get("vehicle_duid")),
+            stop=duid(get("stop_point_duid")),
+            pattern=duid(get("pattern_duid")),
+            latitude=get("latitude"),
+            longitude=get("longitude"),
+            bearing=get("bearing"),
+            arrival=arrival_departure(get("arrival_data")),
+            departure=arrival_departure(get("departure_data")),
+            is_deleted=get("is_deleted"),
+            is_accessible=None if is_accessible is None else bool(is_accessible),
+            has_bike_rack=None if has_bike_rack is None else bool(has_bike_rack),
+            direction=get("direction"),
+            congestion=get("congestion_level"),
+            accuracy=get("accuracy_level"),
+            status=get("status"),
+            category=get("category"),
+        )
+    )
+
+
+def arrival_departure(
+    j: Optional[Dict[str, Any]]
+) -> Optional[m.ArrivalDepartureValues]:
+    if j is None:
+        return None
+    get = j.get
+    scheduled = get("scheduled_passage_time_utc")
+    actual = get("actual_passage_time_utc")
+    direction_text = get("multilingual_direction_text")
+    return m.ArrivalDepartureValues(
+        scheduled=None if scheduled is None else from_seconds(scheduled),
+        actual_or_prediction=None if actual is None else from_seconds(actual),
+        service_mode=get("service_mode"),
+        type=get("type"),
+        direction_text=None
+        if direction_text is None
+        else direction_text.get("defaultValue"),
+    )
+
+
+def duid(j: Optional[Dict[str, str]]) -> Optional[str]:
+    return None if j is None else j.get("duid")
+
+
+def from_milliseconds(ms: Union[int, float]) -> datetime:
+    if type(ms) is int:
+        return epoch + timedelta(milliseconds=ms)
+    else:
+        return datetime.fromtimestamp(ms / 1000, utc_plus_one).replace(tzinfo=None)
+
+
+def from_seconds(s: Union[int, float]) -> datetime:
+    if type(s) is int:
+        return epoch + timedelta(seconds=s)
+    else:
+        return datetime.fromtimestamp(s, utc_plus_one).replace(tzinfo=None)
+
+
+def differences(j: Dict[str, Any]) -> List[Tuple[int, m.AnyPassage, m.Passage]]:
+    """The passages the fast decoder reads differently from from_json.
+
+    Types count as well as values, so 1 and True (or 1 and 1.0) differ.
+    """
+    slow = m.StopPassageResponse.from_json(j).passages
+    fast = [
+        cast(m.CompactPassage, p).passage()
+        for p in stop_passage_response_from_json(j).passages
+    ]
+    if len(slow) != len(fast):
+        raise ValueError(f"Decoded {len(fast)} passages, expected {len(slow)}")
+    return [
+        (i, s, f)
+        for i, (s, f) in enumerate(zip(slow, fast))
+        if s != f or repr(s) != repr(f)
+    ]
+
+
+def saved_passage_responses(directory: Path = example_responses) -> List[Path]:
+    """The saved stop passage responses, as opposed to other saved responses."""
+    return [
+        p
+        for p in sorted(directory.glob("*.json"))
+        if "stopPassageTdi" in loads(p.read_bytes())
+    ]
+
+
+def main() -> None:
+    paths = [Path(a) for a in argv[1:]] or saved_passage_responses()
+    if not paths:
+        raise SystemExit(f"No stop passage responses in {example_responses}")
+    failed = False
+    for path in paths:
+        j = loads(path.read_bytes())
+        diffs = differences(j)
+        print(f"{path}: {len(diffs)} passages decoded differently")
+        for i, slow, fast in diffs:
+            failed = True
+            print(f"- passage {i}:\n  from_json: {slow}\n  fast:      {fast}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,17 +11,21 @@ import pandas as pd
 from pandas import DataFrame
 from sklearn.dummy import DummyRegressor
 
-import busboy.database as db
 import busboy.prediction as prediction
 from busboy.apis import stop_passage
 from busboy.constants import example_stops
-from busboy.database import BusSnapshot, default_connection, stop_by_id
+from busboy.database import BusSnapshot
 from busboy.geo import DegreeLatitude, DegreeLongitude
 from busboy.model import Passage, PassageId, RouteId, StopId, VehicleId
-from busboy.prediction import RouteSection
+from busboy.prediction import (
+    ContainmentCache,
+    JourneyTracker,
+    RouteSection,
+    SectionIndex,
+)
 from busboy.prediction.pandas import travel_times
-from busboy.prediction.sklearn import journeys as separate_journeys
-from busboy.util import Just, Maybe, Right, pairwise
+from busboy.reference import shared_reference_data
+from busboy.util import Just, Maybe, pairwise
 from busboy.util.notebooks import read_preprocessed_data
 
 
@@ -46,19 +50,20 @@ def live_test(stop_id: StopId) -> None:
     pd.set_option("display.max_columns", 1_000_000_000)
     pd.set_option("display.width", 1_000_000_000)
     warnings.simplefilter("ignore")
-    stop = stop_by_id(default_connection(), stop_id).value
-    routes_by_id = db.routes_by_id()
-    routes_by_name = db.routes_by_name()
-    timetables = [
-        tt.value
-        for tt in db.timetables(routes_by_name["220"].id)
-        if isinstance(tt, Right)
-    ]
-    variants = {v for timetable in timetables for v in timetable.variants}
+    reference = shared_reference_data()
+    stop = reference.stops_by_id()[stop_id]
+    routes_by_id = reference.routes_by_id()
+    variants = reference.variants("220")
     filtered_variants = {v for v in variants if stop in v.stops}
     timetable = sorted(filtered_variants, key=lambda v: len(v.stops))[-1]
     route_sections = list(prediction.route_sections(timetable.stops))
-    snapshots: Dict[VehicleId, List[BusSnapshot]] = {}
+    section_index = SectionIndex(
+        enumerate(route_sections), cache=ContainmentCache(max_entries=100_000)
+    )
+    journey_index = SectionIndex.for_variants(
+        {timetable: route_sections}, cache=section_index.cache
+    )
+    trackers: Dict[VehicleId, JourneyTracker] = {}
     print("Training predictors…")
     preprocessed_by_timetable = dict(read_preprocessed_data("220"))
     preprocessed = preprocessed_by_timetable[timetable]
@@ -98,7 +103,7 @@ def live_test(stop_id: StopId) -> None:
             )
             response = response[response["route"] == "220"]
             response["sections"] = [
-                containing_sections(route_sections, r.longitude, r.latitude)
+                containing_sections(section_index, r.longitude, r.latitude)
                 for r in response.itertuples()
             ]
             arrived = [
@@ -111,13 +116,13 @@ def live_test(stop_id: StopId) -> None:
             for row, passage in enumerate(response["passage"]):
                 if isinstance(passage.vehicle, Just):
                     snapshot = BusSnapshot.from_passage(passage, loop_start)
-                    snapshots.setdefault(passage.vehicle.value, []).append(snapshot)
-                    timetable_journeys = separate_journeys(
-                        snapshots[passage.vehicle.value],
-                        {timetable},
-                        {timetable: route_sections},
-                    )
-                    journeys = timetable_journeys.get(timetable)
+                    if passage.vehicle.value not in trackers:
+                        trackers[passage.vehicle.value] = JourneyTracker(
+                            {timetable: route_sections}, journey_index
+                        )
+                    tracker = trackers[passage.vehicle.value]
+                    tracker.add(snapshot)
+                    journeys = tracker.dataframe(timetable, last=1)
                     if journeys is not None:
                         journeys = journeys.fillna(value=pd.NaT)
                         nonempty = journeys.loc[:, journeys.notna().any()]
@@ -433,11 +438,9 @@ def show_passage(passage: Passage) -> str:
 
 
 def containing_sections(
-    sections: List[RouteSection], longitude: DegreeLongitude, latitude: DegreeLatitude
+    index: SectionIndex[int], longitude: DegreeLongitude, latitude: DegreeLatitude
 ) -> Set[int]:
-    return {
-        i for i, section in enumerate(sections) if section.contains(longitude, latitude)
-    }
+    return set(index.containing(longitude, latitude))
 
 
 if __name__ == "__main__":
@@ -1,7 +1,9 @@
 import concurrent.futures as cf
 import dataclasses
+import heapq
 import json
 import shelve
+from collections import Counter
 from dataclasses import dataclass
 from datetime import datetime
 from itertools import islice, tee
@@ -39,7 +41,8 @@ from busboy.geo import (
     RawLatitude,
     RawLongitude,
 )
-from busboy.util import Either, Left, Maybe, Nothing, Right, unique
+from busboy.reference import shared_reference_data
+from busboy.util import Either, Just, Left, Maybe, Nothing, Right, unique
 
 data_files = {
     "many-stops": "resources/experiments/many-stops",
@@ -118,20 +121,64 @@ def trip_stops(
     return d
 
 
-def route_cover(d: Dict[m.TripId, Set[m.StopId]]) -> Optional[Set[m.StopId]]:
-    """Supposed to find a (maybe minimal) set of stops that will get all the trips.
+def poll_trip_stops(
+    prs: Iterable[PollResult[m.StopPassageResponse]]
+) -> Dict[m.TripId, Set[m.StopId]]:
+    """The stops each trip was visible at in any of these poll results."""
+    d: Dict[m.TripId, Set[m.StopId]] = {}
+    for pr in prs:
+        for t, stops in trip_stops(pr).items():
+            if isinstance(t, Just):
+                d.setdefault(t.value, set()).update(stops)
+    return d
 
-    Currently only finds the stops common to all trips, and there may be none.
+
+def route_cover(d: Dict[m.TripId, Set[m.StopId]]) -> Optional[Set[m.StopId]]:
+    """Finds a small set of stops that will get all the trips (see stop_cover).
 
     Returns None if the dictionary is empty.
     """
-    cover = None
-    for t, s in d.items():
-        if cover is None:
-            cover = s
+    if not d:
+        return None
+    return stop_cover(d)
+
+
+def stop_cover(d: Dict[m.TripId, Set[m.StopId]]) -> Set[m.StopId]:
+    """A small set of stops at which every trip is visible.
+
+    Greedy set cover: repeatedly takes the stop that sees the most trips not yet
+    seen, then drops any chosen stop whose trips are all seen elsewhere. The
+    result is at most H(n) ≈ ln(n) + 1 times the size of the smallest cover,
+    where n is the most trips visible at any one stop.
+
+    Trips not visible at any stop are left out.
+    """
+    trips: Dict[m.StopId, Set[m.TripId]] = {}
+    for t, stops in d.items():
+        for s in stops:
+            trips.setdefault(s, set()).add(t)
+    uncovered = {t for t, stops in d.items() if stops}
+    # Gains only shrink as trips are covered, so stale entries are upper bounds
+    # and only the top of the heap ever needs recomputing.
+    heap = [(-len(ts), s.raw) for s, ts in trips.items()]
+    heapq.heapify(heap)
+    cover: List[m.StopId] = []
+    while uncovered and heap:
+        negative_gain, raw = heapq.heappop(heap)
+        stop = m.StopId(raw)
+        gain = len(trips[stop] & uncovered)
+        if gain < -negative_gain:
+            if gain > 0:
+                heapq.heappush(heap, (-gain, raw))
         else:
-            cover = cover.intersection(s)
-    return cover
+            cover.append(stop)
+            uncovered -= trips[stop]
+    seen_by = Counter(t for s in cover for t in trips[s])
+    for stop in list(reversed(cover)):
+        if all(seen_by[t] > 1 for t in trips[stop]):
+            seen_by.subtract(trips[stop])
+            cover.remove(stop)
+    return set(cover)
 
 
 def stop_counts(d: Dict[m.TripId, Set[m.StopId]]) -> StopCounts:
@@ -154,13 +201,14 @@ def stop_trips(pr: PollResult[m.StopPassageResponse]) -> StopTrips:
 
 def show_presences() -> None:
     prs = many_stops_data()
-    rbn = db.routes_by_name()
+    reference = shared_reference_data()
+    rbn = reference.routes_by_name()
     prs_220 = [
         pr.map(lambda spr: spr.filter(lambda p: p.route.raw == rbn["220"].id))
         for pr in prs
     ]
-    rbi = db.routes_by_id()
-    sbi = {s.id: s for s in db.stops()}
+    rbi = reference.routes_by_id()
+    sbi = reference.stops_by_id()
     print(presence_display(trip_presences(prs[0]), sbi, rbi))
 
 
@@ -182,8 +230,8 @@ def route_ids(prs: List[PollResult[m.StopPassageResponse]]) -> Set[Maybe[m.Route
 
 def updates(
     prs: List[PollResult[m.StopPassageResponse]]
-) -> Dict[Maybe[m.TripId], List[m.Passage]]:
-    times: Dict[Maybe[m.TripId], Set[m.Passage]] = {}
+) -> Dict[Maybe[m.TripId], List[m.AnyPassage]]:
+    times: Dict[Maybe[m.TripId], Set[m.AnyPassage]] = {}
     for pr in prs:
         for p in PollResult.all_passages(pr):
             times.setdefault(p.trip, set()).add(p)
@@ -198,9 +246,9 @@ def update_times(
 
 def vehicle_updates(
     prs: List[PollResult[m.StopPassageResponse]]
-) -> Dict[Maybe[m.VehicleId], Dict[datetime, Dict[m.StopId, List[m.Passage]]]]:
+) -> Dict[Maybe[m.VehicleId], Dict[datetime, Dict[m.StopId, List[m.AnyPassage]]]]:
     times: Dict[
-        Maybe[m.VehicleId], Dict[datetime, Dict[m.StopId, List[m.Passage]]]
+        Maybe[m.VehicleId], Dict[datetime, Dict[m.StopId, List[m.AnyPassage]]]
     ] = {}
     for pr in prs:
         for s, spr in pr.results.items():
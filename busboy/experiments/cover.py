@@ -0,0 +1,50 @@
+"""Prints a small set of stops at which every trip in some poll results is seen.
+
+The poll results are JSON files (as written by convert_shelf_to_json) or
+shelves. The stop ids are printed on one line, so they can be passed straight
+to the recorder:
+
+    python -m busboy.main $(python -m busboy.experiments.cover many-stops.json)
+
+Only trips visible at the stops that were polled can be covered, so the poll
+results should come from polling every stop (or at least a superset of the
+stops wanted) through a busy part of the day.
+"""
+from sys import argv, stderr
+from typing import List
+
+import busboy.model as m
+from busboy.experiments import (
+    poll_result_data,
+    poll_shelve_data,
+    poll_trip_stops,
+    stop_cover,
+)
+from busboy.experiments.types import PollResult
+
+
+def main() -> None:
+    paths = argv[1:]
+    if not paths:
+        print("Usage: python -m busboy.experiments.cover <poll results>…", file=stderr)
+        raise SystemExit(2)
+    prs = [pr for path in paths for pr in load(path)]
+    trip_stops = poll_trip_stops(prs)
+    cover = stop_cover(trip_stops)
+    polled = {s for pr in prs for s in pr.results}
+    print(
+        f"{len(cover)} of {len(polled)} stops see all {len(trip_stops)} trips",
+        file=stderr,
+    )
+    print(" ".join(sorted(s.raw for s in cover)))
+
+
+def load(path: str) -> List[PollResult[m.StopPassageResponse]]:
+    if path.endswith(".json"):
+        return poll_result_data(path)
+    else:
+        return poll_shelve_data(path)
+
+
+if __name__ == "__main__":
+    main()
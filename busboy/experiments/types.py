@@ -64,7 +64,7 @@ class PollResult(Generic[T]):
         return {t for ts in PollResult.trips(pr).results.values() for t in ts}
 
     @staticmethod
-    def all_passages(pr: PollResult[m.StopPassageResponse]) -> Set[m.Passage]:
+    def all_passages(pr: PollResult[m.StopPassageResponse]) -> Set[m.AnyPassage]:
         return {p for _, spr in pr.results.items() for p in spr.passages}
 
 
@@ -83,7 +83,7 @@ class PassageTrip(object):
     bearing: Optional[int]
 
     @staticmethod
-    def from_passage(p: m.Passage) -> "PassageTrip":
+    def from_passage(p: m.AnyPassage) -> "PassageTrip":
         return PassageTrip(
             p.trip, p.route, p.vehicle, p.latitude, p.longitude, p.bearing
         )
@@ -1,13 +1,33 @@
 from sys import argv
+from typing import Callable
 
+import psycopg2
+
+import busboy.database as db
+import busboy.migrations as migrations
 import busboy.recording as rec
+import busboy.recording.schedule as schedule
 
 
 def main() -> None:
-    if len(argv) == 1:
-        rec.loop()
+    args = argv[1:]
+    record: Callable[..., None] = rec.loop
+    if args[:1] == ["--async"]:
+        record = rec.async_loop
+        args = args[1:]
+    elif args[:1] == ["--adaptive"]:
+        record = schedule.adaptive_loop
+        args = args[1:]
+    try:
+        with db.pooled_connection() as c:
+            migrations.ensure_partitions(c)
+    except psycopg2.Error as e:
+        # Rows still land in the default partition, so keep recording.
+        print(f"Couldn’t create the passage_responses partitions: {e}")
+    if len(args) == 0:
+        record()
     else:
-        rec.loop(argv[1:])
+        record(args)
 
 
 if __name__ == "__main__":
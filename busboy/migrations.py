@@ -0,0 +1,242 @@
+"""Versioned changes to the database schema.
+
+Each migration is a SQL file in resources/migrations named
+<version>-<description>.sql. Migrations are applied in order of version, each
+in its own transaction, and recorded in the schema_migrations table.
+
+    python -m busboy.migrations status
+    python -m busboy.migrations migrate
+    python -m busboy.migrations copy [--drop]
+    python -m busboy.migrations partitions
+
+copy moves the rows left in passage_responses_unpartitioned by the
+partitioning migration into the monthly partitions, one month per
+transaction. It can be stopped and run again. With --drop, it drops the old
+table once every month has been copied and counted. partitions creates the
+monthly partitions for the next couple of months, which the collector also
+does whenever it starts.
+"""
+from __future__ import annotations
+
+import datetime as dt
+from dataclasses import dataclass
+from pathlib import Path
+from sys import argv
+from typing import Any, Iterator, List, Optional, Set, Tuple, cast
+
+from psycopg2.extensions import connection
+
+import busboy.database as db
+
+migrations_directory = Path(__file__).parent.parent / "resources" / "migrations"
+
+# The version of the migration that partitions passage_responses.
+partitioning_version = 3
+
+passage_columns = """
+    route_id, direction, vehicle_id, last_modified, trip_id, congestion_level,
+    accuracy_level, status, is_accessible, latitude, longitude, bearing,
+    pattern_id, has_bike_rack, category, poll_time
+"""
+
+
+@dataclass(frozen=True)
+class Migration(object):
+    version: int
+    description: str
+    path: Path
+
+    @staticmethod
+    def from_path(path: Path) -> Migration:
+        version, description = path.stem.split("-", 1)
+        return Migration(int(version), description.replace("-", " "), path)
+
+    def sql(self) -> str:
+        return self.path.read_text()
+
+
+def migrations(directory: Path = migrations_directory) -> List[Migration]:
+    if not directory.is_dir():
+        raise FileNotFoundError(f"No migrations directory at {directory}")
+    ms = sorted(
+        (Migration.from_path(p) for p in directory.glob("*.sql")),
+        key=lambda m: m.version,
+    )
+    versions = [m.version for m in ms]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {directory}: {versions}")
+    return ms
+
+
+def applied_versions(c: connection) -> Set[int]:
+    """The versions of the migrations applied to the database."""
+    with c, c.cursor() as cu:
+        cu.execute("select to_regclass('schema_migrations')")
+        if cast(Tuple[Any, ...], cu.fetchone())[0] is None:
+            return set()
+        cu.execute("select version from schema_migrations")
+        return {row[0] for row in cu.fetchall()}
+
+
+def pending(c: connection, directory: Path = migrations_directory) -> List[Migration]:
+    applied = applied_versions(c)
+    return [m for m in migrations(directory) if m.version not in applied]
+
+
+def migrate(c: connection, directory: Path = migrations_directory) -> List[Migration]:
+    """Applies the pending migrations, returning them."""
+    with c, c.cursor() as cu:
+        cu.execute(
+            """
+            create table if not exists schema_migrations (
+                version integer primary key,
+                description text not null,
+                applied_at timestamp not null default now()
+            )
+            """
+        )
+    ms = pending(c, directory)
+    for m in ms:
+        print(f"Applying migration {m.version} ({m.description})…")
+        with c, c.cursor() as cu:
+            cu.execute(m.sql())
+            cu.execute(
+                "insert into schema_migrations (version, description) values (%s, %s)",
+                (m.version, m.description),
+            )
+    return ms
+
+
+def ensure_partitions(
+    c: connection, months_ahead: int = 2, today: Optional[dt.date] = None
+) -> bool:
+    """Creates the passage_responses partitions for this month and the next few.
+
+    Does nothing, returning False, if passage_responses isn’t partitioned yet.
+    """
+    if partitioning_version not in applied_versions(c):
+        return False
+    first = dt.date.today() if today is None else today
+    with c, c.cursor() as cu:
+        cu.execute(
+            "select create_passage_partitions(%s, %s)",
+            (first, first + dt.timedelta(days=31 * months_ahead)),
+        )
+    return True
+
+
+def unpartitioned_months(c: connection) -> List[Tuple[dt.date, int]]:
+    """The months with rows in passage_responses_unpartitioned, and their counts.
+
+    Also indexes the table by last_modified, so each month can be copied
+    without reading the whole table. The index is a BRIN index, which is quick
+    to build and tiny, since rows were inserted roughly in time order.
+    """
+    with c, c.cursor() as cu:
+        cu.execute(
+            """
+            create index if not exists passage_responses_unpartitioned_last_modified
+            on passage_responses_unpartitioned using brin (last_modified)
+            """
+        )
+        cu.execute(
+            """
+            select date_trunc('month', last_modified)::date, count(*)
+            from passage_responses_unpartitioned
+            group by 1
+            order by 1
+            """
+        )
+        return [(row[0], row[1]) for row in cu.fetchall()]
+
+
+def copy_month(c: connection, month: dt.date) -> Tuple[int, int]:
+    """Copies one month of passage_responses_unpartitioned into its partition.
+
+    Returns the numbers of rows inserted and of rows in the month afterwards.
+    Rows already copied are skipped, so a month can be copied again.
+    """
+    start, end = month, next_month(month)
+    with c, c.cursor() as cu:
+        cu.execute("select create_passage_partitions(%s, %s)", (start, start))
+        cu.execute(
+            f"""
+            insert into passage_responses ({passage_columns})
+            select {passage_columns} from passage_responses_unpartitioned
+            where last_modified >= %s and last_modified < %s
+            on conflict (trip_id, last_modified) do nothing
+            """,
+            (start, end),
+        )
+        inserted = cu.rowcount
+        cu.execute(
+            """
+            select count(*) from passage_responses
+            where last_modified >= %s and last_modified < %s
+            """,
+            (start, end),
+        )
+        return inserted, cast(Tuple[Any, ...], cu.fetchone())[0]
+
+
+def copy_unpartitioned(c: connection) -> Iterator[Tuple[dt.date, int, int, int]]:
+    """Copies every month, yielding each with its rows expected, inserted and found.
+
+    Found can exceed expected, if the collector has stored rows for the
+    month since the migration.
+    """
+    for month, expected in unpartitioned_months(c):
+        inserted, found = copy_month(c, month)
+        yield month, expected, inserted, found
+
+
+def next_month(d: dt.date) -> dt.date:
+    return (d.replace(day=1) + dt.timedelta(days=32)).replace(day=1)
+
+
+def drop_unpartitioned(c: connection) -> None:
+    with c, c.cursor() as cu:
+        cu.execute("drop table passage_responses_unpartitioned")
+
+
+def status(c: connection) -> None:
+    applied = applied_versions(c)
+    for m in migrations():
+        mark = "applied" if m.version in applied else "pending"
+        print(f"{m.version:4} {mark:8} {m.description}")
+
+
+def copy(c: connection, drop: bool) -> None:
+    complete = True
+    for month, expected, inserted, found in copy_unpartitioned(c):
+        print(
+            f"{month:%Y-%m}: {expected} rows, {inserted} copied, "
+            f"{found} in the partition"
+        )
+        complete = complete and found >= expected
+    if not complete:
+        print("Some months are missing rows; passage_responses_unpartitioned kept.")
+    elif drop:
+        drop_unpartitioned(c)
+        print("Dropped passage_responses_unpartitioned.")
+
+
+def main() -> None:
+    command = argv[1:2] or ["status"]
+    with db.pooled_connection() as c:
+        if command == ["status"]:
+            status(c)
+        elif command == ["migrate"]:
+            if migrate(c) == []:
+                print("No migrations to apply.")
+        elif command == ["copy"]:
+            copy(c, "--drop" in argv[2:])
+        elif command == ["partitions"]:
+            if not ensure_partitions(c):
+                print("passage_responses isn’t partitioned yet.")
+        else:
+            raise SystemExit(__doc__)
+
+
+if __name__ == "__main__":
+    main()
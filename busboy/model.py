@@ -32,6 +32,7 @@ from busboy.geo import (
     RawLongitude,
 )
 from busboy.util import Just, Maybe, Nothing, omap
+from busboy.util.typevars import A, B
 
 
 @dataclass(frozen=True)
@@ -135,7 +136,7 @@ StopPassageResponseJson = Dict[str, Union[int, PassageJson]]
 
 @dataclass(frozen=True)
 class StopPassageResponse(object):
-    passages: Tuple[Passage, ...]
+    passages: Tuple[AnyPassage, ...]
 
     @staticmethod
     def from_json(json: Dict[str, Any]) -> StopPassageResponse:
@@ -149,7 +150,7 @@ class StopPassageResponse(object):
     @staticmethod
     def from_my_json(j: MyStopPassageResponseJson) -> StopPassageResponse:
         return StopPassageResponse(
-            tuple(Passage.from_my_json(p) for p in j["passages"])
+            tuple(CompactPassage.from_my_json(p) for p in j["passages"])
         )
 
     def to_json(self) -> MyStopPassageResponseJson:
@@ -158,7 +159,7 @@ class StopPassageResponse(object):
     def trip_ids(self) -> List[Maybe[TripId]]:
         return [p.trip for p in self.passages]
 
-    def filter(self, f: Callable[["Passage"], bool]) -> StopPassageResponse:
+    def filter(self, f: Callable[[AnyPassage], bool]) -> StopPassageResponse:
         return StopPassageResponse(tuple(p for p in self.passages if f(p)))
 
     def contains_trip(self, t: Optional[TripId]) -> bool:
@@ -210,6 +211,10 @@ class Passage(object):
             )
         )
 
+    @property
+    def fingerprint(self) -> Tuple[Any, ...]:
+        return CompactPassage.from_passage(self).fingerprint
+
     @staticmethod
     def from_json(json: Dict[str, Any]) -> Passage:
         time = PassageTime.from_json(json)
@@ -351,6 +356,331 @@ class Passage(object):
         }
 
 
+class PassageValues(NamedTuple):
+    id: Optional[str]
+    last_modified: Optional[datetime]
+    trip: Optional[str]
+    route: Optional[str]
+    vehicle: Optional[str]
+    stop: Optional[str]
+    pattern: Optional[str]
+    latitude: Optional[RawLatitude]
+    longitude: Optional[RawLongitude]
+    bearing: Optional[int]
+    arrival: Optional[ArrivalDepartureValues]
+    departure: Optional[ArrivalDepartureValues]
+    is_deleted: Optional[bool]
+    is_accessible: Optional[bool]
+    has_bike_rack: Optional[bool]
+    direction: Optional[int]
+    congestion: Optional[int]
+    accuracy: Optional[int]
+    status: Optional[int]
+    category: Optional[int]
+
+
+class ArrivalDepartureValues(NamedTuple):
+    scheduled: Optional[datetime]
+    actual_or_prediction: Optional[datetime]
+    service_mode: Optional[int]
+    type: Optional[int]
+    direction_text: Optional[str]
+
+
+# An ArrivalTime or a DepartureTime.
+AnyArrivalDeparture = TypeVar("AnyArrivalDeparture", bound="ArrivalDeparture")
+
+
+class CompactPassage(object):
+    """A passage stored as one tuple of plain values, with None where missing.
+
+    Reads like a Passage: each field is a property that builds the Maybe (or
+    PassageTime) a Passage would hold. Equality and hashing use the plain
+    values, so a CompactPassage is never equal to a Passage.
+    """
+
+    __slots__ = ("values", "_fingerprint")
+
+    def __init__(self, values: PassageValues) -> None:
+        self.values = values
+        self._fingerprint: Optional[Tuple[Any, ...]] = None
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, CompactPassage):
+            return self.values == other.values
+        else:
+            return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.values)
+
+    def __repr__(self) -> str:
+        return f"CompactPassage({self.values!r})"
+
+    @property
+    def fingerprint(self) -> Tuple[Any, ...]:
+        """The fields that are stored (see database.passage_row).
+
+        Compared as they are, rather than hashed, so no change can be missed
+        through a collision. Worked out once, on first use.
+        """
+        if self._fingerprint is None:
+            v = self.values
+            self._fingerprint = (
+                v.last_modified,
+                v.trip,
+                v.route,
+                v.vehicle,
+                v.pattern,
+                v.latitude,
+                v.longitude,
+                v.bearing,
+                v.is_accessible,
+                v.has_bike_rack,
+                v.direction,
+                v.congestion,
+                v.accuracy,
+                v.status,
+                v.category,
+            )
+        return self._fingerprint
+
+    @property
+    def id(self) -> Maybe[PassageId]:
+        return wrap_optional(self.values.id, PassageId)
+
+    @property
+    def last_modified(self) -> Maybe[datetime]:
+        return Maybe.of(self.values.last_modified)
+
+    @property
+    def trip(self) -> Maybe[TripId]:
+        return wrap_optional(self.values.trip, TripId)
+
+    @property
+    def route(self) -> Maybe[RouteId]:
+        return wrap_optional(self.values.route, RouteId)
+
+    @property
+    def vehicle(self) -> Maybe[VehicleId]:
+        return wrap_optional(self.values.vehicle, VehicleId)
+
+    @property
+    def stop(self) -> Maybe[StopId]:
+        return wrap_optional(self.values.stop, StopId)
+
+    @property
+    def pattern(self) -> Maybe[PatternId]:
+        return wrap_optional(self.values.pattern, PatternId)
+
+    @property
+    def latitude(self) -> Maybe[RawLatitude]:
+        return Maybe.of(self.values.latitude)
+
+    @property
+    def longitude(self) -> Maybe[RawLongitude]:
+        return Maybe.of(self.values.longitude)
+
+    @property
+    def bearing(self) -> Maybe[int]:
+        return Maybe.of(self.values.bearing)
+
+    @property
+    def time(self) -> PassageTime:
+        return PassageTime(
+            arrival=wrap_optional(self.values.arrival, ArrivalTime.from_values),
+            departure=wrap_optional(self.values.departure, DepartureTime.from_values),
+        )
+
+    @property
+    def is_deleted(self) -> Maybe[bool]:
+        return Maybe.of(self.values.is_deleted)
+
+    @property
+    def is_accessible(self) -> Maybe[bool]:
+        return Maybe.of(self.values.is_accessible)
+
+    @property
+    def has_bike_rack(self) -> Maybe[bool]:
+        return Maybe.of(self.values.has_bike_rack)
+
+    @property
+    def direction(self) -> Maybe[int]:
+        return Maybe.of(self.values.direction)
+
+    @property
+    def congestion(self) -> Maybe[int]:
+        return Maybe.of(self.values.congestion)
+
+    @property
+    def accuracy(self) -> Maybe[int]:
+        return Maybe.of(self.values.accuracy)
+
+    @property
+    def status(self) -> Maybe[int]:
+        return Maybe.of(self.values.status)
+
+    @property
+    def category(self) -> Maybe[int]:
+        return Maybe.of(self.values.category)
+
+    @property
+    def position(self) -> Maybe[Tuple[DegreeLatitude, DegreeLongitude]]:
+        v = self.values
+        if v.latitude is None or v.longitude is None:
+            return Nothing()
+        else:
+            return Just(
+                (
+                    DegreeLatitude(v.latitude / 3_600_000),
+                    DegreeLongitude(v.longitude / 3_600_000),
+                )
+            )
+
+    @staticmethod
+    def from_passage(p: Passage) -> CompactPassage:
+        def values(t: Maybe[AnyArrivalDeparture]) -> Optional[ArrivalDepartureValues]:
+            return t.map(lambda t: t.values()).optional()
+
+        return CompactPassage(
+            PassageValues(
+                id=p.id.map(lambda i: i.raw).optional(),
+                last_modified=p.last_modified.optional(),
+                trip=p.trip.map(lambda i: i.raw).optional(),
+                route=p.route.map(lambda i: i.raw).optional(),
+                vehicle=p.vehicle.map(lambda i: i.raw).optional(),
+                stop=p.stop.map(lambda i: i.raw).optional(),
+                pattern=p.pattern.map(lambda i: i.raw).optional(),
+                latitude=p.latitude.optional(),
+                longitude=p.longitude.optional(),
+                bearing=p.bearing.optional(),
+                arrival=values(p.time.arrival),
+                departure=values(p.time.departure),
+                is_deleted=p.is_deleted.optional(),
+                is_accessible=p.is_accessible.optional(),
+                has_bike_rack=p.has_bike_rack.optional(),
+                direction=p.direction.optional(),
+                congestion=p.congestion.optional(),
+                accuracy=p.accuracy.optional(),
+                status=p.status.optional(),
+                category=p.category.optional(),
+            )
+        )
+
+    def passage(self) -> Passage:
+        return Passage(
+            id=self.id,
+            last_modified=self.last_modified,
+            trip=self.trip,
+            route=self.route,
+            vehicle=self.vehicle,
+            stop=self.stop,
+            pattern=self.pattern,
+            latitude=self.latitude,
+            longitude=self.longitude,
+            bearing=self.bearing,
+            time=self.time,
+            is_deleted=self.is_deleted,
+            is_accessible=self.is_accessible,
+            has_bike_rack=self.has_bike_rack,
+            direction=self.direction,
+            congestion=self.congestion,
+            accuracy=self.accuracy,
+            status=self.status,
+            category=self.category,
+        )
+
+    def to_json(self) -> MyPassageJson:
+        return self.passage().to_json()
+
+    @staticmethod
+    def from_my_json(j: MyPassageJson) -> CompactPassage:
+        def values(
+            t: Optional[MyArrivalDepartureJson]
+        ) -> Optional[ArrivalDepartureValues]:
+            if t is None:
+                return None
+            else:
+                return ArrivalDepartureValues(
+                    scheduled=optional_datetime(t.get("scheduled")),
+                    actual_or_prediction=optional_datetime(
+                        t.get("actual_or_prediction")
+                    ),
+                    service_mode=cast(Optional[int], t.get("service_mode")),
+                    type=cast(Optional[int], t.get("type")),
+                    direction_text=cast(Optional[str], t.get("direction_text")),
+                )
+
+        time = cast(MyPassageTimeJson, j["time"])
+        return CompactPassage(
+            PassageValues(
+                id=cast(Optional[str], j["id"]),
+                last_modified=optional_datetime(j["last_modified"]),
+                trip=cast(Optional[str], j["trip_id"]),
+                route=cast(Optional[str], j["route_id"]),
+                vehicle=cast(Optional[str], j["vehicle_id"]),
+                stop=cast(Optional[str], j["stop_id"]),
+                pattern=cast(Optional[str], j["pattern_id"]),
+                latitude=cast(Optional[RawLatitude], j["latitude"]),
+                longitude=cast(Optional[RawLongitude], j["longitude"]),
+                bearing=cast(Optional[int], j["bearing"]),
+                arrival=values(time.get("arrival")),
+                departure=values(time.get("departure")),
+                is_deleted=cast(Optional[bool], j["is_deleted"]),
+                is_accessible=cast(Optional[bool], j["is_accessible"]),
+                has_bike_rack=cast(Optional[bool], j["has_bike_rack"]),
+                direction=cast(Optional[int], j["direction"]),
+                congestion=cast(Optional[int], j["congestion"]),
+                accuracy=cast(Optional[int], j["accuracy"]),
+                status=cast(Optional[int], j["status"]),
+                category=cast(Optional[int], j["category"]),
+            )
+        )
+
+    def flatten(self) -> Dict[str, Any]:
+        v = self.values
+        arrival = v.arrival or ArrivalDepartureValues(None, None, None, None, None)
+        departure = v.departure or ArrivalDepartureValues(None, None, None, None, None)
+        return {
+            "id": v.id,
+            "last_modified": v.last_modified,
+            "trip": v.trip,
+            "route": v.route,
+            "vehicle": v.vehicle,
+            "stop": v.stop,
+            "pattern": v.pattern,
+            "latitude": None if v.latitude is None else v.latitude / 3_600_000,
+            "longitude": None if v.longitude is None else v.longitude / 3_600_000,
+            "bearing": v.bearing,
+            "scheduled_arrival": arrival.scheduled,
+            "predicted_arrival": arrival.actual_or_prediction,
+            "scheduled_departure": departure.scheduled,
+            "predicted_departure": departure.actual_or_prediction,
+            "is_accessible": v.is_accessible,
+            "has_bike_rack": v.has_bike_rack,
+            "direction": v.direction,
+            "congestion": v.congestion,
+            "accuracy": v.accuracy,
+            "status": v.status,
+            "category": v.category,
+            "passage": self,
+        }
+
+
+AnyPassage = Union[Passage, CompactPassage]
+
+
+def wrap_optional(x: Optional[A], f: Callable[[A], B]) -> Maybe[B]:
+    if x is None:
+        return Nothing()
+    else:
+        return Just(f(x))
+
+
+def optional_datetime(s: Any) -> Optional[datetime]:
+    return None if s is None else datetime.fromisoformat(cast(str, s))
+
+
 @dataclass(frozen=True)
 class PassageTime(object):
     arrival: Maybe[ArrivalTime]
@@ -428,6 +758,25 @@ class ArrivalDeparture(object):
             ),
         )
 
+    @classmethod
+    def from_values(cls: Type[T], v: ArrivalDepartureValues) -> T:
+        return cls(
+            scheduled=Maybe.of(v.scheduled),
+            actual_or_prediction=Maybe.of(v.actual_or_prediction),
+            service_mode=Maybe.of(v.service_mode),
+            type=Maybe.of(v.type),
+            direction_text=Maybe.of(v.direction_text),
+        )
+
+    def values(self) -> ArrivalDepartureValues:
+        return ArrivalDepartureValues(
+            scheduled=self.scheduled.optional(),
+            actual_or_prediction=self.actual_or_prediction.optional(),
+            service_mode=self.service_mode.optional(),
+            type=self.type.optional(),
+            direction_text=self.direction_text.optional(),
+        )
+
     def to_json(self) -> MyArrivalDepartureJson:
         return {
             "scheduled": self.scheduled.map(lambda dt: dt.isoformat()).optional(),
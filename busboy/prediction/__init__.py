@@ -1,15 +1,18 @@
 from __future__ import annotations
 
-from collections import defaultdict, namedtuple
-from dataclasses import dataclass
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from functools import lru_cache, partial, reduce, singledispatch
-from itertools import count, dropwhile
+from itertools import count
+from math import floor
 from typing import (
     Any,
     Callable,
+    Deque,
     Dict,
     Generator,
+    Generic,
     Iterable,
     Iterator,
     List,
@@ -17,6 +20,7 @@ from typing import (
     Optional,
     Set,
     Tuple,
+    TypeVar,
     Union,
     cast,
     overload,
@@ -28,15 +32,21 @@ import pandas as pd
 import shapely.geometry as sg
 from shapely.geometry import LineString, Point
 
+try:
+    from shapely import contains_xy
+except ImportError:  # Shapely 1.x
+    from shapely.vectorized import contains as contains_xy
+
 import busboy.apis as api
 import busboy.constants as c
 import busboy.database as db
 import busboy.model as m
 import busboy.util as u
 from busboy.geo import Latitude, Longitude, to_metre_point
-from busboy.util import Just, Maybe, Nothing, drop, first, pairwise, tuplewise_padded
+from busboy.util import Just, Maybe, Nothing, drop, pairwise, tuplewise_padded
 
 Coord = Tuple[Latitude, Longitude]
+K = TypeVar("K")
 DistanceVector = NewType("DistanceVector", Tuple[float, float])
 
 
@@ -129,17 +139,91 @@ def angle_between(v1: DistanceVector, v2: DistanceVector) -> float:
 RouteSection = Union["RoadSection", "StopCircle"]
 
 
-@lru_cache(maxsize=2 ** 24)
-def cached_contains(polygon: sg.Polygon, lon: Longitude, lat: Latitude) -> bool:
-    return polygon.contains(Point(lat, lon))
+@dataclass(frozen=True)
+class CacheStats(object):
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+
+
+class ContainmentCache(object):
+    """A bounded memo of which points are in which route sections.
+
+    Meant to be created for one pipeline run (or one live process) rather than
+    shared globally. Entries are keyed on the section’s geometry, so an equal
+    section rebuilt later still gets hits. Once max_entries is reached, the
+    least recently used entries are evicted.
+    """
+
+    def __init__(self, max_entries: int = 1_000_000) -> None:
+        self.max_entries = max_entries
+        self.entries: OrderedDict[Tuple[bytes, float, float], bool] = OrderedDict()
+        self.geometry_keys: Dict[int, Tuple[AbstractRouteSection, bytes]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def contains(
+        self, section: AbstractRouteSection, lon: Longitude, lat: Latitude
+    ) -> bool:
+        key = (self.geometry_key(section), lon, lat)
+        result = self.entries.get(key)
+        if result is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return result
+        self.misses += 1
+        result = section.polygon.contains(Point(lat, lon))
+        self.entries[key] = result
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    def geometry_key(self, section: AbstractRouteSection) -> bytes:
+        # Keeping a reference to the section stops its id being reused.
+        known = self.geometry_keys.get(id(section))
+        if known is None:
+            if len(self.geometry_keys) >= self.max_entries:
+                self.geometry_keys.clear()
+            known = (section, section.polygon.wkb)
+            self.geometry_keys[id(section)] = known
+        return known[1]
+
+    def stats(self) -> CacheStats:
+        return CacheStats(self.hits, self.misses, self.evictions, len(self.entries))
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.geometry_keys.clear()
 
 
 @dataclass(frozen=True)
 class AbstractRouteSection(object):
     polygon: sg.Polygon
 
-    def contains(self, lon: Longitude, lat: Latitude) -> bool:
-        return cached_contains(self.polygon, lon, lat)
+    def contains(
+        self, lon: Longitude, lat: Latitude, cache: Optional[ContainmentCache] = None
+    ) -> bool:
+        if cache is None:
+            return self.polygon.contains(Point(lat, lon))
+        else:
+            return cache.contains(self, lon, lat)
+
+    def contains_points(self, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+        """Which of the points are in this section, as an array of booleans."""
+        min_lat, min_lon, max_lat, max_lon = self.polygon.bounds
+        output = np.zeros(len(lats), dtype=bool)
+        nearby = np.flatnonzero(
+            (lats >= min_lat)
+            & (lats <= max_lat)
+            & (lons >= min_lon)
+            & (lons <= max_lon)
+        )
+        if len(nearby) > 0:
+            output[nearby] = contains_xy(self.polygon, lats[nearby], lons[nearby])
+        return output
 
 
 @dataclass(frozen=True)
@@ -233,16 +317,135 @@ def widen_line(linestring: sg.LineString, width: float) -> sg.Polygon:
     return sg.MultiLineString(linestrings).minimum_rotated_rectangle
 
 
+class SectionIndex(Generic[K]):
+    """A uniform grid over route sections, for finding the ones near a point.
+
+    Each section is registered in every grid cell its bounding box touches, so
+    a lookup only tests the handful of sections around the point rather than
+    all of them. Sections are registered under keys (e.g. their variant and
+    position); a section object registered under several keys is only tested
+    once. Single-point lookups go through cache, if one is given.
+    """
+
+    def __init__(
+        self,
+        sections: Iterable[Tuple[K, RouteSection]],
+        cell_size: float = 0.005,
+        cache: Optional[ContainmentCache] = None,
+    ) -> None:
+        self.cell_size = cell_size
+        self.cache = cache
+        self.sections: List[RouteSection] = []
+        self.placements: List[Tuple[K, int]] = []
+        self.section_placements: List[List[int]] = []
+        self.section_cells: List[List[Tuple[int, int]]] = []
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        section_numbers: Dict[int, int] = {}
+        for key, section in sections:
+            n = section_numbers.get(id(section))
+            if n is None:
+                n = len(self.sections)
+                section_numbers[id(section)] = n
+                self.sections.append(section)
+                self.section_placements.append([])
+                min_lat, min_lon, max_lat, max_lon = section.polygon.bounds
+                x1, y1 = self.cell(min_lon, min_lat)
+                x2, y2 = self.cell(max_lon, max_lat)
+                cells = [(x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+                self.section_cells.append(cells)
+                for c in cells:
+                    self.cells.setdefault(c, []).append(n)
+            self.section_placements[n].append(len(self.placements))
+            self.placements.append((key, n))
+
+    @staticmethod
+    def for_variants(
+        sections: Dict[api.TimetableVariant, List[RouteSection]],
+        cell_size: float = 0.005,
+        cache: Optional[ContainmentCache] = None,
+    ) -> SectionIndex[Tuple[api.TimetableVariant, int]]:
+        """An index of each variant’s sections, keyed by (variant, position)."""
+        return SectionIndex(
+            (
+                ((tv, position), section)
+                for tv, rs in sections.items()
+                for position, section in enumerate(rs)
+            ),
+            cell_size,
+            cache,
+        )
+
+    def cell(self, lon: float, lat: float) -> Tuple[int, int]:
+        return (floor(lon / self.cell_size), floor(lat / self.cell_size))
+
+    def containing(self, lon: Longitude, lat: Latitude) -> List[K]:
+        """The keys of the sections containing a point, in registration order."""
+        placements = sorted(
+            p
+            for n in self.cells.get(self.cell(lon, lat), [])
+            if self.sections[n].contains(lon, lat, self.cache)
+            for p in self.section_placements[n]
+        )
+        return [self.placements[p][0] for p in placements]
+
+    def memberships(
+        self, lons: np.ndarray, lats: np.ndarray
+    ) -> Iterator[Tuple[int, K]]:
+        """Finds the sections containing each of a batch of points.
+
+        Each section is tested once, against only the points in its cells.
+
+        Yields:
+            (index of point, key), ordered by key registration, then point.
+        """
+        valid = np.flatnonzero(~(np.isnan(lons) | np.isnan(lats)))
+        cell_xs = np.floor(lons[valid] / self.cell_size).astype(np.int64)
+        cell_ys = np.floor(lats[valid] / self.cell_size).astype(np.int64)
+        points_by_cell: Dict[Tuple[int, int], List[int]] = {}
+        for i, x, y in zip(valid.tolist(), cell_xs.tolist(), cell_ys.tolist()):
+            points_by_cell.setdefault((x, y), []).append(i)
+        found: List[np.ndarray] = []
+        for section, cells in zip(self.sections, self.section_cells):
+            candidates = np.array(
+                sorted(i for c in cells for i in points_by_cell.get(c, [])),
+                dtype=np.int64,
+            )
+            if len(candidates) > 0:
+                candidates = candidates[
+                    section.contains_points(lons[candidates], lats[candidates])
+                ]
+            found.append(candidates)
+        for key, n in self.placements:
+            for i in found[n]:
+                yield (int(i), key)
+
+
 def assign_region(
-    sections: Iterable[RouteSection], e: db.BusSnapshot
+    sections: Iterable[RouteSection],
+    e: db.BusSnapshot,
+    index: Optional[SectionIndex[RouteSection]] = None,
 ) -> Tuple[db.BusSnapshot, List[RouteSection]]:
-    return (e, [s for s in sections if s.polygon.contains(e.point)])
+    """The sections containing a snapshot.
+
+    If given, index must be an index of sections, keyed by the sections
+    themselves (see sections_index).
+    """
+    if index is None:
+        return (e, [s for s in sections if s.polygon.contains(e.point)])
+    else:
+        return (e, index.containing(e.longitude, e.latitude))
 
 
 def assign_regions(
     rs: Iterable[RouteSection], es: Iterable[db.BusSnapshot]
 ) -> Generator[Tuple[db.BusSnapshot, List[RouteSection]], None, None]:
-    return (assign_region(rs, e) for e in es)
+    sections = list(rs)
+    index = sections_index(sections)
+    return (assign_region(sections, e, index) for e in es)
+
+
+def sections_index(sections: Iterable[RouteSection]) -> SectionIndex[RouteSection]:
+    return SectionIndex((s, s) for s in sections)
 
 
 def most_recent_stops(
@@ -264,37 +467,81 @@ def most_recent_stops(
 def possible_variants(
     snapshots: Iterable[db.BusSnapshot],
     sections: Dict[api.TimetableVariant, List[RouteSection]],
+    index: Optional[SectionIndex[Tuple[api.TimetableVariant, int]]] = None,
 ) -> Iterable[Tuple[db.BusSnapshot, Set[Tuple[api.TimetableVariant, int]]]]:
-    for snapshot in snapshots:
-        positions = []
-        for tv, rs in sections.items():
-            for i, section in enumerate(rs):
-                if section.contains(snapshot.longitude, snapshot.latitude):
-                    positions.append((tv, i))
-        yield (snapshot, set(positions))
+    """Finds the (variant, position) of each section containing each snapshot.
+
+    index, if given, must be SectionIndex.for_variants(sections); pass one in to
+    avoid rebuilding it for every call with the same sections.
+    """
+    snapshots = list(snapshots)
+    lons = np.array([s.longitude for s in snapshots], dtype=float)
+    lats = np.array([s.latitude for s in snapshots], dtype=float)
+    positions: List[List[Tuple[api.TimetableVariant, int]]] = [[] for s in snapshots]
+    for i, tv, position in section_memberships(lons, lats, sections, index):
+        positions[i].append((tv, position))
+    return zip(snapshots, (set(p) for p in positions))
+
+
+def section_memberships(
+    lons: np.ndarray,
+    lats: np.ndarray,
+    sections: Dict[api.TimetableVariant, List[RouteSection]],
+    index: Optional[SectionIndex[Tuple[api.TimetableVariant, int]]] = None,
+) -> Iterator[Tuple[int, api.TimetableVariant, int]]:
+    """Finds the sections containing each of a batch of points.
+
+    Each distinct section is tested once, against the nearby points at the
+    same time.
+
+    Yields:
+        (index of point, variant, position of section in variant), ordered by
+        variant, then position, then point.
+    """
+    if index is None:
+        index = SectionIndex.for_variants(sections)
+    for i, (tv, position) in index.memberships(lons, lats):
+        yield (i, tv, position)
 
 
 def check_variant_order(
     snapshots: List[Tuple[db.BusSnapshot, Set[Tuple[api.TimetableVariant, int]]]]
 ) -> Iterable[Tuple[db.BusSnapshot, Set[Tuple[api.TimetableVariant, int]]]]:
-    for i, (snapshot, positions) in enumerate(snapshots):
-        output_positions: Set[Tuple[api.TimetableVariant, int]] = set()
+    """Keeps the positions that the bus is next seen to move forward from.
+
+    A (variant, position) is kept if the next snapshot with any positions that
+    doesn’t include it has the bus further along the same variant.
+
+    Works backwards through the snapshots, so that each snapshot’s next change
+    can be found from the one after it, in linear time.
+    """
+    outputs: List[Set[Tuple[api.TimetableVariant, int]]] = [set() for s in snapshots]
+    # For the last snapshot with positions seen so far (next_nonempty), the
+    # index of the first later snapshot with different positions, per position.
+    next_changes: Dict[Tuple[api.TimetableVariant, int], Optional[int]] = {}
+    next_nonempty: Optional[int] = None
+    variant_positions: Dict[int, Dict[api.TimetableVariant, int]] = {}
+    for i in reversed(range(len(snapshots))):
+        positions = snapshots[i][1]
+        if len(positions) == 0:
+            continue
+        changes: Dict[Tuple[api.TimetableVariant, int], Optional[int]] = {}
         for variant, position in positions:
-            later_positions = map(lambda j: snapshots[j][1], range(i, len(snapshots)))
-            first_change_positions = dict(
-                first(
-                    dropwhile(
-                        lambda ps: len(ps) == 0 or (variant, position) in ps,
-                        later_positions,
-                    )
-                ).or_else([])
-            )
+            j = next_changes.get((variant, position), next_nonempty)
+            changes[(variant, position)] = j
+            if j is None:
+                continue
+            if j not in variant_positions:
+                variant_positions[j] = dict(snapshots[j][1])
+            first_change_positions = variant_positions[j]
             if (
                 variant in first_change_positions
                 and first_change_positions[variant] > position
             ):
-                output_positions.add((variant, position))
-        yield (snapshot, output_positions)
+                outputs[i].add((variant, position))
+        next_changes = changes
+        next_nonempty = i
+    return ((snapshot, output) for (snapshot, _), output in zip(snapshots, outputs))
 
 
 def duplicate_positions(s1: db.BusSnapshot, s2: db.BusSnapshot) -> bool:
@@ -337,10 +584,31 @@ def section_times(
         exited in snapshots, in order of exit.
     """
     section_windows: Dict[api.TimetableVariant, List[SectionTime]] = defaultdict(list)
-    sections_entered: Dict[Tuple[api.TimetableVariant, int], EntryWindow] = {}
-    last_positions: Dict[api.TimetableVariant, Set[int]] = {}
-    last_time: Maybe[datetime] = Nothing()
+    timer = SectionTimer()
     for snapshot, positions in snapshots:
+        for variant, section_time in timer.add(snapshot, positions):
+            section_windows[variant].append(section_time)
+    return section_windows
+
+
+class SectionTimer(object):
+    """Works out section entry and exit times one snapshot at a time.
+
+    A snapshot in no sections (of any variant) counts as the bus leaving all of
+    the sections it was in.
+    """
+
+    def __init__(self) -> None:
+        self.sections_entered: Dict[Tuple[api.TimetableVariant, int], EntryWindow] = {}
+        self.last_positions: Dict[api.TimetableVariant, Set[int]] = {}
+        self.last_time: Maybe[datetime] = Nothing()
+
+    def add(
+        self, snapshot: db.BusSnapshot, positions: Dict[api.TimetableVariant, Set[int]]
+    ) -> List[Tuple[api.TimetableVariant, SectionTime]]:
+        """The sections exited by the time of snapshot, in order of exit."""
+        exited: List[Tuple[api.TimetableVariant, SectionTime]] = []
+        last_time = self.last_time
         update_positions = False
         for variant, these_positions in positions.items():
             if not these_positions:
@@ -348,31 +616,31 @@ def section_times(
             else:
                 update_positions = True
             for position in these_positions.difference(
-                last_positions.get(variant, set())
+                self.last_positions.get(variant, set())
             ):
                 window = (last_time, Just(snapshot.poll_time))
-                sections_entered[(variant, position)] = window
-            for position in last_positions.get(variant, set()).difference(
+                self.sections_entered[(variant, position)] = window
+            for position in self.last_positions.get(variant, set()).difference(
                 these_positions
             ):
-                exit_interval = last_time, Just(snapshot.poll_time)
-                section_time = SectionTime(
-                    (position, sections_entered[(variant, position)], exit_interval)
-                )
-                section_windows[variant].append(section_time)
-        for variant, old_positions in last_positions.items():
+                exited.append((variant, self.exit(variant, position, snapshot)))
+        for variant, old_positions in self.last_positions.items():
             if variant not in positions:
                 for position in list(old_positions):
-                    exit_interval = last_time, Just(snapshot.poll_time)
-                    section_time = SectionTime(
-                        (position, sections_entered[(variant, position)], exit_interval)
-                    )
-                    section_windows[variant].append(section_time)
+                    exited.append((variant, self.exit(variant, position, snapshot)))
                     old_positions.remove(position)
         if update_positions:
-            last_positions = positions
-            last_time = Just(snapshot.poll_time)
-    return section_windows
+            self.last_positions = positions
+            self.last_time = Just(snapshot.poll_time)
+        return exited
+
+    def exit(
+        self, variant: api.TimetableVariant, position: int, snapshot: db.BusSnapshot
+    ) -> SectionTime:
+        exit_interval = self.last_time, Just(snapshot.poll_time)
+        return SectionTime(
+            (position, self.sections_entered[(variant, position)], exit_interval)
+        )
 
 
 def journeys(
@@ -473,17 +741,19 @@ def stop_times(
             stops: List[StopArrival] = []
             for position, entry, exit in journey:
                 if isinstance(sections[variant][position], StopCircle):
-                    if isinstance(entry[1], Just) and isinstance(exit[0], Just):
-                        stops.append(
-                            SeenAtStop(entry[0], entry[1].value, exit[0].value, exit[1])
-                        )
-                    else:
-                        stops.append(NotSeenAtStop(entry[0], exit[1]))
+                    stops.append(stop_arrival(entry, exit))
             journey_stops.append(stops)
         output[variant] = journey_stops
     return output
 
 
+def stop_arrival(entry: EntryWindow, exit: ExitWindow) -> StopArrival:
+    if isinstance(entry[1], Just) and isinstance(exit[0], Just):
+        return SeenAtStop(entry[0], entry[1].value, exit[0].value, exit[1])
+    else:
+        return NotSeenAtStop(entry[0], exit[1])
+
+
 def journeys_dataframe(
     journeys: Iterable[
         Tuple[api.TimetableVariant, List[List[Optional[Tuple[datetime, datetime]]]]]
@@ -527,6 +797,190 @@ def estimate_arrival(
         yield (variant, new_journeys)
 
 
+@dataclass
+class HeldSnapshot(object):
+    snapshot: db.BusSnapshot
+    positions: Set[Tuple[api.TimetableVariant, int]]
+    forward: Dict[Tuple[api.TimetableVariant, int], bool] = field(default_factory=dict)
+
+    def undecided(self) -> int:
+        return len(self.positions) - len(self.forward)
+
+    def kept(self) -> Tuple[db.BusSnapshot, Set[Tuple[api.TimetableVariant, int]]]:
+        return (self.snapshot, {p for p in self.positions if self.forward[p]})
+
+
+class VariantOrderChecker(object):
+    """check_variant_order for snapshots that arrive one at a time.
+
+    A snapshot is held back until the bus has been seen outside each of its
+    positions, and snapshots are released in the order they were added.
+    """
+
+    def __init__(self) -> None:
+        self.held: Deque[HeldSnapshot] = deque()
+        self.waiting: Dict[Tuple[api.TimetableVariant, int], List[HeldSnapshot]] = {}
+
+    def add(
+        self, snapshot: db.BusSnapshot, positions: Set[Tuple[api.TimetableVariant, int]]
+    ) -> List[Tuple[db.BusSnapshot, Set[Tuple[api.TimetableVariant, int]]]]:
+        if positions:
+            # Everything still waiting has been in every snapshot with positions
+            # since, so this is the first change for whatever isn’t in positions.
+            first_change_positions = dict(positions)
+            for variant, position in [p for p in self.waiting if p not in positions]:
+                forward = (
+                    variant in first_change_positions
+                    and first_change_positions[variant] > position
+                )
+                for held in self.waiting.pop((variant, position)):
+                    held.forward[(variant, position)] = forward
+        held = HeldSnapshot(snapshot, positions)
+        for p in positions:
+            self.waiting.setdefault(p, []).append(held)
+        self.held.append(held)
+        return self.released()
+
+    def finish(
+        self
+    ) -> List[Tuple[db.BusSnapshot, Set[Tuple[api.TimetableVariant, int]]]]:
+        """Releases every held snapshot, without the positions still waiting."""
+        for p, held_snapshots in self.waiting.items():
+            for held in held_snapshots:
+                held.forward[p] = False
+        self.waiting.clear()
+        return self.released()
+
+    def released(
+        self
+    ) -> List[Tuple[db.BusSnapshot, Set[Tuple[api.TimetableVariant, int]]]]:
+        output = []
+        while self.held and self.held[0].undecided() == 0:
+            output.append(self.held.popleft().kept())
+        return output
+
+
+@dataclass
+class VariantJourneys(object):
+    """A vehicle’s stop arrivals on one variant, split into journeys."""
+
+    journeys: List[List[StopArrival]] = field(default_factory=lambda: [[]])
+    last_position: int = -1
+    last_exit: ExitWindow = (Nothing(), Nothing())
+
+    def add(
+        self, section_time: SectionTime, sections: List[RouteSection]
+    ) -> List[StopArrival]:
+        """Adds the next section exited, as journeys and pad_journeys would."""
+        position, entry, exit = section_time
+        if position < self.last_position:
+            self.journeys.append([])
+            self.last_position = -1
+            self.last_exit = (Nothing(), Nothing())
+        times = [
+            SectionTime(
+                (
+                    missing_position,
+                    (self.last_exit[0], Nothing()),
+                    (Nothing(), self.last_exit[1]),
+                )
+            )
+            for missing_position in range(self.last_position + 1, position)
+        ]
+        times.append(section_time)
+        arrivals = [
+            stop_arrival(entry, exit)
+            for position, entry, exit in times
+            if isinstance(sections[position], StopCircle)
+        ]
+        self.journeys[-1].extend(arrivals)
+        self.last_position = position
+        self.last_exit = exit
+        return arrivals
+
+
+class JourneyTracker(object):
+    """Follows one vehicle along some timetable variants, a snapshot at a time.
+
+    Snapshots should be added in order of poll time. Stop arrivals are worked
+    out once, as the bus leaves each stop, and never revised: they are the
+    ones stop_times would give for all of the snapshots so far, except that
+    the most recent snapshots are held back until check_variant_order can
+    decide on them.
+    """
+
+    def __init__(
+        self,
+        sections: Dict[api.TimetableVariant, List[RouteSection]],
+        index: Optional[SectionIndex[Tuple[api.TimetableVariant, int]]] = None,
+    ) -> None:
+        self.sections = sections
+        self.index = SectionIndex.for_variants(sections) if index is None else index
+        self.order = VariantOrderChecker()
+        self.timer = SectionTimer()
+        self.variant_journeys: Dict[api.TimetableVariant, VariantJourneys] = {}
+        self.last_snapshot: Optional[db.BusSnapshot] = None
+
+    def add(
+        self, snapshot: db.BusSnapshot
+    ) -> List[Tuple[api.TimetableVariant, StopArrival]]:
+        """Adds the vehicle’s next snapshot, returning any new stop arrivals."""
+        if self.last_snapshot is not None and duplicate_positions(
+            self.last_snapshot, snapshot
+        ):
+            return []
+        self.last_snapshot = snapshot
+        positions = set(self.index.containing(snapshot.longitude, snapshot.latitude))
+        return self.arrivals(self.order.add(snapshot, positions))
+
+    def finish(self) -> List[Tuple[api.TimetableVariant, StopArrival]]:
+        """Uses the held snapshots too, once the vehicle won’t be seen again."""
+        return self.arrivals(self.order.finish())
+
+    def arrivals(
+        self,
+        snapshots: List[Tuple[db.BusSnapshot, Set[Tuple[api.TimetableVariant, int]]]],
+    ) -> List[Tuple[api.TimetableVariant, StopArrival]]:
+        output = []
+        for snapshot, positions in snapshots:
+            variant_positions = {
+                v: {t[1] for t in ts}
+                for v, ts in u.dict_collect_set(positions, lambda t: t[0]).items()
+            }
+            for variant, section_time in self.timer.add(snapshot, variant_positions):
+                if variant not in self.variant_journeys:
+                    self.variant_journeys[variant] = VariantJourneys()
+                for arrival in self.variant_journeys[variant].add(
+                    section_time, self.sections[variant]
+                ):
+                    output.append((variant, arrival))
+        return output
+
+    def current_sections(self) -> Dict[api.TimetableVariant, Set[int]]:
+        """The positions of the sections the bus was last seen in, per variant."""
+        return self.timer.last_positions
+
+    def journeys(self, variant: api.TimetableVariant) -> List[List[StopArrival]]:
+        if variant in self.variant_journeys:
+            return self.variant_journeys[variant].journeys
+        else:
+            return []
+
+    def dataframe(
+        self, variant: api.TimetableVariant, last: Optional[int] = None
+    ) -> Optional[pd.DataFrame]:
+        """Estimated arrival and departure times, as journeys_dataframe gives them.
+
+        If last is given, only the last that many journeys are included.
+        """
+        if variant not in self.variant_journeys:
+            return None
+        js = self.journeys(variant)
+        if last is not None:
+            js = js[-last:]
+        return next(journeys_dataframe(estimate_arrival([(variant, js)])))[1]
+
+
 def stop_times_proximity(
     snapshots: Iterable[db.BusSnapshot],
     stops: Iterable[m.Stop],
@@ -1,27 +1,29 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from itertools import chain
-from typing import Dict, List, Set, Tuple
+from itertools import chain, groupby
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import pandas as pd
 from sklearn.base import BaseEstimator, TransformerMixin
 
 import busboy.apis as api
 import busboy.database as db
+import busboy.model as m
 from busboy import prediction
-from busboy.prediction import RouteSection
+from busboy.prediction import RouteSection, SectionIndex
 from busboy.util import dict_collect, dict_collect_list, dict_collect_set
 
 
 def journeys(
-    snapshots: List[db.BusSnapshot],
+    snapshots: Iterable[db.BusSnapshot],
     timetable_variants: Set[api.TimetableVariant],
     route_sections: Dict[api.TimetableVariant, List[RouteSection]],
+    index: Optional[SectionIndex[Tuple[api.TimetableVariant, int]]] = None,
 ) -> Dict[api.TimetableVariant, pd.DataFrame]:
     pvars = sorted(
         prediction.possible_variants(
-            prediction.drop_duplicate_positions(snapshots), route_sections
+            prediction.drop_duplicate_positions(snapshots), route_sections, index
         ),
         key=lambda t: t[0].poll_time,
     )
@@ -42,6 +44,24 @@ def journeys(
     )
 
 
+def vehicle_journeys(
+    snapshots: Iterable[db.BusSnapshot],
+    timetable_variants: Set[api.TimetableVariant],
+    route_sections: Dict[api.TimetableVariant, List[RouteSection]],
+) -> Iterator[Tuple[m.VehicleId, Dict[api.TimetableVariant, pd.DataFrame]]]:
+    """Journeys for each vehicle in a stream of snapshots grouped by vehicle.
+
+    Use with db.iter_snapshots(..., by_vehicle=True) to process long periods
+    while holding only one vehicle’s snapshots in memory.
+    """
+    index = SectionIndex.for_variants(route_sections)
+    for vehicle, vehicle_snapshots in groupby(snapshots, key=lambda s: s.vehicle):
+        yield (
+            vehicle,
+            journeys(vehicle_snapshots, timetable_variants, route_sections, index),
+        )
+
+
 def join_journeys(
     journeys: List[Dict[api.TimetableVariant, pd.DataFrame]],
 ) -> Dict[api.TimetableVariant, pd.DataFrame]:
@@ -1,12 +1,26 @@
 from __future__ import annotations
 
+import asyncio
 import datetime as dt
 import time
+from collections import Counter
 from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed
-from threading import Event, Timer
+from dataclasses import dataclass, field
+from threading import Event, Lock, Timer
 from time import strftime
-from typing import Callable, Dict, Generator, Iterable, List, NoReturn, Optional, Tuple
+from typing import (
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    NoReturn,
+    Optional,
+    Set,
+    Tuple,
+)
 
+import aiohttp
 import psycopg2 as pp2
 from psycopg2.extensions import connection
 
@@ -15,65 +29,305 @@ import busboy.constants as c
 import busboy.database as db
 import busboy.model as m
 import busboy.util as u
+from busboy.client import EndpointStats, shared_client
 from busboy.util import Just
 from busboy.util.typevars import *
 
 
-def loop(stops: Iterable[str] = c.cycle_stops, interval: float = 2) -> None:
+def loop(
+    stops: Iterable[str] = c.cycle_stops,
+    interval: float = 2,
+    overrun: u.Overrun = u.Overrun.coalesce,
+    max_concurrent: int = 2,
+) -> None:
+    """Polls the stops every interval seconds.
+
+    Up to max_concurrent cycles can poll at once, so that one slow cycle
+    doesn’t hold back the ones after it. Their passages are stored one cycle
+    at a time.
+    """
     stop_ids = [m.StopId(s) for s in stops]
+    report_rate_limit(len(stop_ids), interval)
     with ThreadPoolExecutor(max_workers=300) as pool:
         d: RecordingState = {}
-        loop_something(lambda state: new_loop(pool, stop_ids, state), d, interval)
+        loop_something(
+            lambda: poll_stops(pool, stop_ids),
+            record_cycle,
+            d,
+            interval,
+            overrun,
+            max_concurrent,
+        )
+
 
+def async_loop(
+    stops: Iterable[str] = c.cycle_stops,
+    interval: float = 2,
+    max_in_flight: int = 100,
+    overrun: u.Overrun = u.Overrun.coalesce,
+) -> None:
+    """Like loop, but polls the stops with asyncio over one keep-alive session.
 
-def loop_something(f: Callable[[A], A], a: A, interval: float) -> None:
-    iterations: Generator[A, None, NoReturn] = u.iterate(f, a)
+    At most max_in_flight requests are outstanding at any time. Cycles run one
+    at a time.
+    """
+    stop_ids = [m.StopId(s) for s in stops]
+    report_rate_limit(len(stop_ids), interval)
     try:
-        for t in u.interval(interval):
-            _ = next(iterations)
+        asyncio.run(async_record(stop_ids, u.Ticker(interval, overrun), max_in_flight))
     except KeyboardInterrupt:
         print("\nExiting…")
 
 
-RecordingState = Dict[m.PassageId, m.Passage]
+async def async_record(
+    stops: List[m.StopId], ticker: u.Ticker, max_in_flight: int
+) -> None:
+    connector = aiohttp.TCPConnector(limit=max_in_flight)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        semaphore = asyncio.Semaphore(max_in_flight)
+        state: RecordingState = {}
+        async for t in u.async_ticks(ticker):
+            start = time.monotonic()
+            state = await async_new_loop(session, semaphore, stops, state)
+            report_schedule(ticker.stats, time.monotonic() - start, t)
+
+
+def loop_something(
+    f: Callable[[], B],
+    g: Callable[[B, A, dt.datetime], A],
+    a: A,
+    interval: float,
+    overrun: u.Overrun = u.Overrun.coalesce,
+    max_concurrent: int = 1,
+) -> None:
+    """Calls f every interval seconds, then g on its result, the state and the tick.
+
+    Up to max_concurrent calls to f can overlap, but calls to g take turns,
+    each given the state from the last call to g. So each result is compared
+    against everything recorded before it. The state from a call to g only
+    replaces the state from a tick that came earlier.
+    """
+    ticker = u.Ticker(interval, overrun)
+    lock = Lock()
+    latest_time, latest = dt.datetime.min, a
+
+    def cycle(t: dt.datetime) -> None:
+        nonlocal latest_time, latest
+        start = time.monotonic()
+        b = f()
+        with lock:
+            result = g(b, latest, t)
+            if t > latest_time:
+                latest_time, latest = t, result
+        report_schedule(ticker.stats, time.monotonic() - start, t)
+
+    try:
+        u.run_every(ticker, cycle, max_concurrent)
+    except KeyboardInterrupt:
+        print("\nExiting…")
+
+
+RecordingState = Dict[m.PassageId, m.AnyPassage]
 
 
 def new_loop(
     pool: ThreadPoolExecutor, stops: Iterable[m.StopId], state: RecordingState
 ) -> RecordingState:
     time = dt.datetime.now()
-    connection = db.default_connection()
-    futures: Dict[Future[m.StopPassageResponse], m.StopId] = call_stops(pool, stops)
-    next_state: RecordingState = {}
-    for i, f in enumerate(as_completed(futures), 1):
-        stop = futures[f]
-        spr = f.result()
-        current = dict(current_state(spr))
-        new_state = updated_state(state, current)
-        store_state(new_state, time, connection)
-        next_state.update(current)
-    return next_state
+    return record_cycle(poll_stops(pool, stops), state, time)
+
+
+def poll_stops(pool: ThreadPoolExecutor, stops: Iterable[m.StopId]) -> Cycle:
+    futures: Dict[Future[StopResult], m.StopId] = call_stops(pool, stops)
+    cycle = Cycle()
+    for f in as_completed(futures):
+        try:
+            spr, unchanged = f.result()
+        except Exception as e:
+            cycle.fail(e)
+        else:
+            cycle.add(spr, unchanged)
+    return cycle
+
+
+async def async_new_loop(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    stops: Iterable[m.StopId],
+    state: RecordingState,
+) -> RecordingState:
+    time = dt.datetime.now()
+    event_loop = asyncio.get_running_loop()
+    requests = [bounded_stop_passage(session, semaphore, stop) for stop in stops]
+    cycle = Cycle()
+    for f in asyncio.as_completed(requests):
+        try:
+            spr, unchanged = await f
+        except Exception as e:
+            cycle.fail(e)
+        else:
+            cycle.add(spr, unchanged)
+    # The database writes block, so keep them off the event loop.
+    return await event_loop.run_in_executor(None, record_cycle, cycle, state, time)
+
+
+@dataclass
+class Cycle(object):
+    """The passages from one poll of every stop, by passage id.
+
+    A bus appears in the responses of many of the stops along its route, each
+    time under a different passage id. Those passages share the key they are
+    stored under, so record_cycle drops all but one of them.
+
+    Unchanged responses are the same objects as last cycle, so their passages
+    are skipped over quickly when diffing against the last state.
+    """
+
+    passages: RecordingState = field(default_factory=dict)
+    responses: int = 0
+    unchanged: int = 0
+    failures: Counter[str] = field(default_factory=Counter)
+
+    def add(self, spr: m.StopPassageResponse, unchanged: bool = False) -> None:
+        self.responses += 1
+        if unchanged:
+            self.unchanged += 1
+        self.passages.update(current_state(spr))
+
+    def fail(self, e: Exception) -> None:
+        """Counts a stop that couldn’t be polled, by the type of error."""
+        self.failures[type(e).__name__] += 1
+
+
+def record_cycle(
+    cycle: Cycle, state: RecordingState, time: dt.datetime
+) -> RecordingState:
+    """Stores the passages that changed since state, returning the next state."""
+    changed = updated_state(state, cycle.passages)
+    distinct, duplicates = distinct_keys(changed)
+    with db.pooled_connection() as connection:
+        result = store_state(distinct, time, connection)
+    report_cycle(cycle, len(changed), duplicates, time)
+    report_stored(result, time)
+    report_requests(shared_client().stats(), time)
+    return cycle.passages
+
+
+# A stop’s response, and whether it’s unchanged since the last.
+StopResult = Tuple[m.StopPassageResponse, bool]
+
+
+async def bounded_stop_passage(
+    session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, stop: m.StopId
+) -> StopResult:
+    # The timeout starts once we hold the semaphore, so queued stops don’t time out.
+    async with semaphore:
+        return await api.stop_passage_if_changed_async(session, stop)
 
 
 def call_stops(
     pool: ThreadPoolExecutor, stops: Iterable[m.StopId]
-) -> Dict[Future[m.StopPassageResponse], m.StopId]:
-    return {pool.submit(api.stop_passage, stop): stop for stop in stops}
+) -> Dict[Future[StopResult], m.StopId]:
+    return {pool.submit(api.stop_passage_if_changed, stop): stop for stop in stops}
 
 
 def current_state(
     spr: m.StopPassageResponse
-) -> Generator[Tuple[m.PassageId, m.Passage], None, None]:
+) -> Generator[Tuple[m.PassageId, m.AnyPassage], None, None]:
     for p in spr.passages:
         if isinstance(p.id, Just):
             yield (p.id.value, p)
 
 
 def updated_state(last: RecordingState, current: RecordingState) -> RecordingState:
-    """Those passages which differ between current and last, or are not in last."""
-    return {i: p for i, p in current.items() if (i not in last or last[i] != p)}
+    """Those passages whose stored fields differ between current and last, or
+    which are not in last.
+    """
+    return {
+        i: p
+        for i, p in current.items()
+        if i not in last or (last[i] is not p and last[i].fingerprint != p.fingerprint)
+    }
+
+
+def distinct_keys(s: RecordingState) -> Tuple[RecordingState, int]:
+    """Keeps one passage for each key they would be stored under.
+
+    Also returns the number of passages dropped. Passages without a key are
+    all kept, for store_trips to count.
+    """
+    output: RecordingState = {}
+    seen: Set[db.PassageKey] = set()
+    for i, p in s.items():
+        key = db.passage_key(p)
+        if key is None or key not in seen:
+            output[i] = p
+        if key is not None:
+            seen.add(key)
+    return output, len(s) - len(output)
+
+
+def store_state(
+    s: RecordingState, poll_time: dt.datetime, c: connection
+) -> db.StoreResult:
+    return db.store_trips(s.values(), poll_time, c)
+
+
+def report_cycle(
+    cycle: Cycle, changed: int, duplicates: int, poll_time: dt.datetime
+) -> None:
+    hit_rate = cycle.unchanged / cycle.responses if cycle.responses else 0
+    print(
+        f"{poll_time.isoformat()}: {cycle.responses} responses "
+        f"({cycle.unchanged} unchanged, {hit_rate:.0%}), "
+        f"{len(cycle.passages)} passages, "
+        f"{changed} changed ({duplicates} duplicates dropped)"
+    )
+    if cycle.failures:
+        failures = ", ".join(f"{n} {e}" for e, n in cycle.failures.most_common())
+        failed = sum(cycle.failures.values())
+        print(f"{poll_time.isoformat()}: {failed} stops failed ({failures})")
+
+
+def report_requests(stats: Dict[str, EndpointStats], poll_time: dt.datetime) -> None:
+    for url, s in stats.items():
+        print(
+            f"{poll_time.isoformat()}: {url}: {s.requests} requests, "
+            f"{s.failures} failed, {s.retries} retried, {s.rejected} rejected, "
+            f"latency {s.mean_latency:.2f}s mean, {s.p95_latency:.2f}s p95, "
+            f"circuit {s.circuit}"
+        )
+
+
+def report_rate_limit(stops: int, interval: float) -> None:
+    """Warns if the shared client’s rate limit keeps cycles longer than interval."""
+    rate = shared_client().rate
+    if rate is not None and stops / interval > rate:
+        print(
+            f"The client is limited to {rate:g} requests a second, so each cycle "
+            f"of {stops} stops will take at least {stops / rate:.1f}s, "
+            f"not {interval:g}s."
+        )
+
+
+def report_schedule(
+    stats: u.CycleStats, duration: float, poll_time: dt.datetime
+) -> None:
+    print(
+        f"{poll_time.isoformat()}: cycle took {duration:.2f}s, "
+        f"started {stats.last_lag:.2f}s late (mean {stats.mean_lag:.2f}s, "
+        f"max {stats.max_lag:.2f}s); {stats.running} running, "
+        f"{stats.overruns} overruns, {stats.missed_ticks} ticks missed"
+    )
 
 
-def store_state(s: RecordingState, poll_time: dt.datetime, c: connection) -> None:
-    for id, passage in s.items():
-        db.store_trip(passage, poll_time, c)
+def report_stored(result: db.StoreResult, poll_time: dt.datetime) -> None:
+    if result.conflicts:
+        keys = ", ".join(f"({t}, {lm.isoformat()})" for t, lm in result.conflicts)
+        print(
+            f"{poll_time.isoformat()}: {len(result.conflicts)} passages already stored: {keys}"
+        )
+    if result.missing_key > 0:
+        print(
+            f"{poll_time.isoformat()}: skipped {result.missing_key} passages without a trip or modification time"
+        )
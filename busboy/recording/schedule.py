@@ -0,0 +1,205 @@
+"""Polls each stop only as often as its passages change.
+
+Vehicle positions are only updated every 20–30 seconds, and many stops have no
+buses at all for hours at a time, so polling every stop every 2 seconds is
+mostly wasted. Each stop’s schedule learns from the last_modified times of the
+passages it returns:
+
+- the time between updates to the same passage is smoothed into an estimate
+  of how often the stop changes, and the stop is polled at a fraction of that,
+  so that updates aren’t missed;
+- empty responses double the time to the next poll, up to a limit;
+- the hours of the day in which the stop has had passages are remembered, so
+  that a stop backed off overnight is polled again when its service starts.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import heapq
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import busboy.apis as api
+import busboy.constants as c
+import busboy.model as m
+from busboy.recording import Cycle, RecordingState, StopResult, record_cycle
+from busboy.util import Just
+
+
+@dataclass
+class StopSchedule(object):
+    """When to poll one stop, and what’s been learned about it so far."""
+
+    stop: m.StopId
+    interval: float
+    change_interval: Optional[float] = None
+    last_modified: Dict[m.PassageId, dt.datetime] = field(default_factory=dict)
+    empty_polls: int = 0
+    active_hours: Set[int] = field(default_factory=set)
+
+    def next_active_hour(self, now: dt.datetime) -> Optional[dt.datetime]:
+        """The start of the next hour after now in which the stop has been active."""
+        start = now.replace(minute=0, second=0, microsecond=0)
+        for hours in range(1, 25):
+            t = start + dt.timedelta(hours=hours)
+            if t.hour in self.active_hours:
+                return t
+        return None
+
+
+class AdaptiveScheduler(object):
+    """Decides which stops are due to be polled, from their previous responses.
+
+    Arguments:
+        min_interval: The shortest time between polls of a stop, in seconds.
+        max_interval: The longest time between polls of a stop, in seconds.
+        smoothing: The weight given to each newly observed time between updates.
+        safety: The fraction of the estimated time between updates to wait
+            between polls.
+    """
+
+    def __init__(
+        self,
+        stops: Iterable[m.StopId],
+        min_interval: float = 2,
+        max_interval: float = 300,
+        smoothing: float = 0.2,
+        safety: float = 0.5,
+    ) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+        self.safety = safety
+        self.schedules = {s: StopSchedule(s, min_interval) for s in stops}
+        now = dt.datetime.now()
+        self.queue: List[Tuple[dt.datetime, str]] = [
+            (now, s.raw) for s in self.schedules
+        ]
+        heapq.heapify(self.queue)
+
+    def due(self, now: dt.datetime) -> List[m.StopId]:
+        """The stops due to be polled by now.
+
+        They are only scheduled again once updated (or failed).
+        """
+        stops = []
+        while self.queue and self.queue[0][0] <= now:
+            _, stop = heapq.heappop(self.queue)
+            stops.append(m.StopId(stop))
+        return stops
+
+    def next_poll(self) -> Optional[dt.datetime]:
+        return self.queue[0][0] if self.queue else None
+
+    def update(
+        self, stop: m.StopId, spr: m.StopPassageResponse, now: dt.datetime
+    ) -> None:
+        """Learns from a stop’s response and schedules its next poll."""
+        schedule = self.schedules[stop]
+        last_modified = {}
+        for p in spr.passages:
+            if isinstance(p.id, Just) and isinstance(p.last_modified, Just):
+                i, lm = p.id.value, p.last_modified.value
+                previous = schedule.last_modified.get(i)
+                if previous is not None and lm > previous:
+                    self.observe_change(schedule, (lm - previous).total_seconds())
+                last_modified[i] = lm
+        schedule.last_modified = last_modified
+        if spr.passages:
+            schedule.empty_polls = 0
+            schedule.active_hours.add(now.hour)
+            if schedule.change_interval is None:
+                interval = self.min_interval
+            else:
+                interval = self.safety * schedule.change_interval
+        else:
+            schedule.empty_polls += 1
+            interval = 2 * schedule.interval
+        self.schedule(schedule, interval, now)
+
+    def failed(self, stop: m.StopId, now: dt.datetime) -> None:
+        """Backs off from a stop whose poll failed."""
+        schedule = self.schedules[stop]
+        self.schedule(schedule, 2 * schedule.interval, now)
+
+    def observe_change(self, schedule: StopSchedule, seconds: float) -> None:
+        if schedule.change_interval is None:
+            schedule.change_interval = seconds
+        else:
+            schedule.change_interval = (
+                self.smoothing * seconds
+                + (1 - self.smoothing) * schedule.change_interval
+            )
+
+    def schedule(
+        self, schedule: StopSchedule, interval: float, now: dt.datetime
+    ) -> None:
+        schedule.interval = min(max(interval, self.min_interval), self.max_interval)
+        next_poll = now + dt.timedelta(seconds=schedule.interval)
+        if schedule.empty_polls > 0:
+            active = schedule.next_active_hour(now)
+            if active is not None and active < next_poll:
+                next_poll = active
+        heapq.heappush(self.queue, (next_poll, schedule.stop.raw))
+
+
+def adaptive_loop(
+    stops: Iterable[str] = c.cycle_stops,
+    min_interval: float = 2,
+    max_interval: float = 300,
+    state_lifetime: dt.timedelta = dt.timedelta(hours=1),
+) -> None:
+    """Like recording.loop, but polls each stop only when it’s due.
+
+    Passages not modified within state_lifetime are forgotten.
+    """
+    scheduler = AdaptiveScheduler(
+        (m.StopId(s) for s in stops), min_interval, max_interval
+    )
+    state: RecordingState = {}
+    with ThreadPoolExecutor(max_workers=300) as pool:
+        try:
+            while True:
+                now = dt.datetime.now()
+                due = scheduler.due(now)
+                if due:
+                    state.update(adaptive_cycle(pool, scheduler, due, state, now))
+                    prune_state(state, now - state_lifetime)
+                next_poll = scheduler.next_poll()
+                if next_poll is not None:
+                    time.sleep(max(0, (next_poll - dt.datetime.now()).total_seconds()))
+        except KeyboardInterrupt:
+            print("\nExiting…")
+
+
+def adaptive_cycle(
+    pool: ThreadPoolExecutor,
+    scheduler: AdaptiveScheduler,
+    stops: List[m.StopId],
+    state: RecordingState,
+    time: dt.datetime,
+) -> RecordingState:
+    futures: Dict[Future[StopResult], m.StopId] = {
+        pool.submit(api.stop_passage_if_changed, stop): stop for stop in stops
+    }
+    cycle = Cycle()
+    for f in as_completed(futures):
+        stop = futures[f]
+        try:
+            spr, unchanged = f.result()
+        except Exception as e:
+            cycle.fail(e)
+            scheduler.failed(stop, dt.datetime.now())
+        else:
+            scheduler.update(stop, spr, dt.datetime.now())
+            cycle.add(spr, unchanged)
+    return record_cycle(cycle, state, time)
+
+
+def prune_state(state: RecordingState, before: dt.datetime) -> None:
+    """Forgets passages last modified before a time (or never)."""
+    for i, p in list(state.items()):
+        if not isinstance(p.last_modified, Just) or p.last_modified.value < before:
+            del state[i]
@@ -0,0 +1,152 @@
+"""Stops, routes and timetables, loaded once per process and shared.
+
+Each kind of reference data is loaded the first time it’s used, indexed by id
+and by name, and kept until it’s older than the store’s ttl (or invalidated),
+when the next use reloads it. Timetables are loaded and kept per route.
+"""
+from __future__ import annotations
+
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Generic, Iterable, List, Optional, Set
+
+import busboy.database as db
+import busboy.model as m
+from busboy.apis import StopNameIndex, Timetable, TimetableVariant
+from busboy.util import Either, Right
+from busboy.util.typevars import A
+
+
+class Cached(Generic[A]):
+    """A value from load, reloaded once it’s older than ttl seconds."""
+
+    def __init__(self, load: Callable[[], A], ttl: float) -> None:
+        self.load = load
+        self.ttl = ttl
+        self.value: Optional[A] = None
+        self.loaded_at = 0.0
+        self.lock = Lock()
+
+    def get(self) -> A:
+        with self.lock:
+            if self.value is None or monotonic() - self.loaded_at > self.ttl:
+                self.value = self.load()
+                self.loaded_at = monotonic()
+            return self.value
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.value = None
+
+
+class Stops(object):
+    def __init__(self, stops: List[m.Stop]) -> None:
+        self.all = stops
+        self.by_id = {s.id: s for s in stops}
+        self.by_name = {s.name: s for s in stops}
+        self.name_index = StopNameIndex(self.by_name)
+
+
+class Routes(object):
+    def __init__(self, routes: List[m.Route]) -> None:
+        self.all = routes
+        self.by_id = {r.id: r for r in routes}
+        self.by_name = {r.name: r for r in routes}
+
+
+class ReferenceData(object):
+    """Cached stops, routes and timetables.
+
+    Arguments:
+        ttl: How long to keep each kind of data before reloading it, in seconds.
+        load_stops: Loads every stop (by default from the stops table).
+        load_routes: Loads every route (by default from the saved routes.json).
+        load_timetables: Loads a route’s timetables (by default from the
+            database).
+    """
+
+    def __init__(
+        self,
+        ttl: float = 6 * 60 * 60,
+        load_stops: Callable[[], List[m.Stop]] = db.stops,
+        load_routes: Callable[[], List[m.Route]] = db.routes,
+        load_timetables: Callable[
+            [m.RouteId], Iterable[Either[str, Timetable]]
+        ] = db.timetables,
+    ) -> None:
+        self.ttl = ttl
+        self.load_timetables = load_timetables
+        self.stop_data = Cached(lambda: Stops(load_stops()), ttl)
+        self.route_data = Cached(lambda: Routes(load_routes()), ttl)
+        self.timetable_data: Dict[m.RouteId, Cached[List[Timetable]]] = {}
+        self.timetables_lock = Lock()
+
+    def stops(self) -> List[m.Stop]:
+        return self.stop_data.get().all
+
+    def stops_by_id(self) -> Dict[m.StopId, m.Stop]:
+        return self.stop_data.get().by_id
+
+    def stops_by_name(self) -> Dict[str, m.Stop]:
+        return self.stop_data.get().by_name
+
+    def stop_name_index(self) -> StopNameIndex:
+        """Matches timetable stop names to the stops, built once per load."""
+        return self.stop_data.get().name_index
+
+    def routes(self) -> List[m.Route]:
+        return self.route_data.get().all
+
+    def routes_by_id(self) -> Dict[m.RouteId, m.Route]:
+        return self.route_data.get().by_id
+
+    def routes_by_name(self) -> Dict[str, m.Route]:
+        return self.route_data.get().by_name
+
+    def timetables(self, route: m.RouteId) -> List[Timetable]:
+        """The route’s timetables, leaving out any that couldn’t be loaded."""
+        with self.timetables_lock:
+            if route not in self.timetable_data:
+                self.timetable_data[route] = Cached(
+                    lambda: [
+                        t.value
+                        for t in self.load_timetables(route)
+                        if isinstance(t, Right)
+                    ],
+                    self.ttl,
+                )
+            cached = self.timetable_data[route]
+        return cached.get()
+
+    def variants(self, route_name: str) -> Set[TimetableVariant]:
+        """The variants in the timetables of the route with this name."""
+        route = self.routes_by_name()[route_name]
+        return {v for t in self.timetables(route.id) for v in t.variants}
+
+    def invalidate(self) -> None:
+        """Reloads everything the next time it’s used."""
+        self.stop_data.invalidate()
+        self.route_data.invalidate()
+        with self.timetables_lock:
+            self.timetable_data.clear()
+
+
+reference_data: Optional[ReferenceData] = None
+reference_data_lock = Lock()
+
+
+def configure_reference_data(r: ReferenceData) -> ReferenceData:
+    """Replaces the shared reference data."""
+    global reference_data
+    with reference_data_lock:
+        reference_data = r
+        return reference_data
+
+
+def shared_reference_data() -> ReferenceData:
+    """The shared reference data, created with default settings if needed."""
+    global reference_data
+    with reference_data_lock:
+        if reference_data is None:
+            reference_data = ReferenceData()
+        return reference_data
@@ -18,7 +18,8 @@ def hello():
 
 @app.route("/points/<trip_id>/")
 def trip_points(trip_id: str):
-    tps = db.trip_points(db.default_connection(), TripId(trip_id))
+    with db.pooled_connection() as connection:
+        tps = db.trip_points(connection, TripId(trip_id))
     response = json.dumps(tps.to_json())
     return (response, {"Content-Type": "text/json", "Access-Control-Allow-Origin": "*"})
 
@@ -31,7 +32,8 @@ def trips_on_day(date: str, route: Optional[str] = None):
     except ValueError:
         abort(400)
     else:
-        trips = db.trips_on_day(db.default_connection(), d, route)
+        with db.pooled_connection() as connection:
+            trips = db.trips_on_day(connection, d, route)
         body = [t.raw for t in trips]
         return (
             json.dumps(body),
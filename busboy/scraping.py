@@ -0,0 +1,132 @@
+"""Scrapes the timetables of many routes at once, skipping unchanged pages.
+
+Route pages are fetched concurrently and saved on disk under the hash of their
+content. An index keeps, for each route, the hash of its last stored page and
+a hash of the stop names it was matched against. A page is only parsed and
+stored again if either hash has changed, so adding or renaming stops updates
+the timetables of routes whose pages haven’t changed.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import busboy.apis as api
+from busboy.apis import StopNameIndex, StopNames, Timetable
+
+cache_directory = Path("data/timetable-pages")
+
+
+@dataclass(frozen=True)
+class RoutePage(object):
+    route: str
+    digest: str
+    stops: str  # The hash of the stop names the page was matched against.
+    timetables: List[Timetable]
+
+
+class PageCache(object):
+    """Timetable pages on disk, and the hashes each route was last stored with."""
+
+    def __init__(self, directory: Path = cache_directory) -> None:
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index_path = directory / "index.json"
+        self.index: Dict[str, Dict[str, str]] = {}
+        if self.index_path.exists():
+            self.index = json.loads(self.index_path.read_text())
+
+    def save(self, html: bytes) -> str:
+        """Saves a page, if it isn’t already saved, returning its hash."""
+        digest = hashlib.sha256(html).hexdigest()
+        path = self.path(digest)
+        if not path.exists():
+            partial = path.with_suffix(".partial")
+            partial.write_bytes(html)
+            partial.replace(path)
+        return digest
+
+    def load(self, digest: str) -> bytes:
+        return self.path(digest).read_bytes()
+
+    def path(self, digest: str) -> Path:
+        return self.directory / f"{digest}.html"
+
+    def changed(self, route: str, digest: str, stops: str) -> bool:
+        return self.index.get(route) != {"page": digest, "stops": stops}
+
+    def page_digest(self, route: str) -> Optional[str]:
+        """The hash of the route’s last stored page, if it has one."""
+        entry = self.index.get(route)
+        return entry.get("page") if isinstance(entry, dict) else None
+
+    def stored(self, page: RoutePage) -> None:
+        """Records that a route’s page has been stored, so it’s skipped next time."""
+        self.index[page.route] = {"page": page.digest, "stops": page.stops}
+        partial = self.index_path.with_suffix(".partial")
+        partial.write_text(json.dumps(self.index, indent=2, sort_keys=True))
+        partial.replace(self.index_path)
+
+
+def scrape(
+    routes: Iterable[str],
+    stops_by_name: StopNames,
+    cache: PageCache,
+    max_workers: int = 8,
+    force: bool = False,
+) -> Iterator[RoutePage]:
+    """Fetches routes’ pages, up to max_workers at once, parsing those that changed.
+
+    A page has changed if it, or the stop names, differ from when the route was
+    last stored. Pages are yielded as they arrive. Call cache.stored once a page
+    has been stored; until then, it counts as changed. With force, every page
+    counts as changed.
+    """
+    index = api.stop_name_index(stops_by_name)
+    stops = stops_digest(index)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(api.timetable_page, route): route for route in routes}
+        for f in as_completed(futures):
+            route = futures[f]
+            try:
+                html = f.result()
+            except Exception as e:
+                print(f"Couldn’t fetch the timetables for route {route}: {e}")
+                continue
+            digest = cache.save(html)
+            if not force and not cache.changed(route, digest, stops):
+                print(f"Route {route}’s timetables haven’t changed.")
+                continue
+            yield RoutePage(route, digest, stops, parse(html, index, route))
+
+
+def stops_digest(index: StopNameIndex) -> str:
+    """A hash of the stop names, their ids and the aliases an index matches with."""
+    h = hashlib.sha256()
+    for name in index.names:
+        h.update(f"{name}\0{index.stops[name].id.raw}\n".encode())
+    for alias, name in sorted(index.aliases.items()):
+        h.update(f"{alias}\0{name}\n".encode())
+    return h.hexdigest()
+
+
+def parse(html: bytes, stops_by_name: StopNames, route: str) -> List[Timetable]:
+    index = api.stop_name_index(stops_by_name)
+    return [
+        Timetable.from_web_timetable(wt, index, route)
+        for wt in api.parse_timetable_page(html, route)
+    ]
+
+
+def reparse(
+    cache: PageCache, stops_by_name: StopNames, route: str
+) -> Optional[List[Timetable]]:
+    """Parses a route’s last stored page again, if it has one."""
+    digest = cache.page_digest(route)
+    if digest is None:
+        return None
+    return parse(cache.load(digest), stops_by_name, route)
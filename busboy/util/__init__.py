@@ -1,14 +1,19 @@
 from __future__ import annotations
 
+import asyncio
 import datetime as dt
 import rlcompleter
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from enum import Enum
 from functools import partial
 from itertools import chain, filterfalse, groupby, islice, repeat, tee, zip_longest
 from operator import itemgetter
+from threading import BoundedSemaphore, Lock
 from typing import (
+    AsyncGenerator,
     Callable,
     Dict,
     Generator,
@@ -118,14 +123,166 @@ def iterate(f: Callable[[A], A], a: A) -> Generator[A, None, NoReturn]:
         yield a
 
 
-def interval(i: float) -> Generator[dt.datetime, None, NoReturn]:
+class Overrun(Enum):
+    """What to do about the ticks that pass while every cycle slot is busy.
+
+    skip: wait for the next tick, so cycles keep to the ticks but some are lost.
+    coalesce: start one cycle straight away in place of all the missed ticks,
+        then carry on with the ticks.
+    immediate: start straight away and count the next interval from then, so
+        the ticks shift later by however long the overrun was.
+    """
+
+    skip = "skip"
+    coalesce = "coalesce"
+    immediate = "immediate"
+
+
+@dataclass
+class CycleStats(object):
+    """How well cycles have kept to their ticks, in seconds."""
+
+    cycles: int = 0
+    running: int = 0
+    overruns: int = 0
+    missed_ticks: int = 0
+    last_lag: float = 0.0
+    max_lag: float = 0.0
+    total_lag: float = 0.0
+    last_duration: float = 0.0
+    max_duration: float = 0.0
+
+    @property
+    def mean_lag(self) -> float:
+        return self.total_lag / self.cycles if self.cycles else 0.0
+
+
+class Ticker(object):
+    """Ticks every interval seconds (on the monotonic clock), for cycles to start on.
+
+    Ticks are counted from the first, rather than from the end of the previous
+    cycle, so that the time a cycle takes doesn’t add up into drift. A cycle
+    that starts late but before the following tick is only lagging; one that
+    can’t start until after the following tick has overrun, and the ticks in
+    between are dealt with by the overrun policy.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        overrun: Overrun = Overrun.coalesce,
+        start: Optional[float] = None,
+    ) -> None:
+        self.interval = interval
+        self.overrun = overrun
+        self.next_tick = time.monotonic() if start is None else start
+        self.stats = CycleStats()
+        self.lock = Lock()
+
+    def wait(self) -> float:
+        """The number of seconds until the next tick."""
+        return max(0.0, self.next_tick - time.monotonic())
+
+    def start(self, now: float) -> bool:
+        """Whether a cycle should start now, at or after the next tick.
+
+        If so, it’s counted as running until finish is called.
+        """
+        with self.lock:
+            late = now - self.next_tick
+            if late < 0:
+                return False
+            if late >= self.interval:
+                missed = int(late // self.interval)
+                self.stats.overruns += 1
+                if self.overrun is Overrun.skip:
+                    self.stats.missed_ticks += missed + 1
+                    self.next_tick += (missed + 1) * self.interval
+                    return False
+                elif self.overrun is Overrun.coalesce:
+                    self.stats.missed_ticks += missed
+                    self.next_tick += missed * self.interval
+                else:
+                    self.next_tick = now
+            lag = now - self.next_tick
+            self.stats.cycles += 1
+            self.stats.running += 1
+            self.stats.last_lag = lag
+            self.stats.max_lag = max(self.stats.max_lag, lag)
+            self.stats.total_lag += lag
+            self.next_tick += self.interval
+            return True
+
+    def finish(self, duration: float) -> None:
+        with self.lock:
+            self.stats.running -= 1
+            self.stats.last_duration = duration
+            self.stats.max_duration = max(self.stats.max_duration, duration)
+
+
+def interval(
+    i: float, overrun: Overrun = Overrun.immediate
+) -> Generator[dt.datetime, None, NoReturn]:
+    return ticks(Ticker(i, overrun))
+
+
+def ticks(ticker: Ticker) -> Generator[dt.datetime, None, NoReturn]:
+    """Yields at each tick, timing the work done between yields as a cycle."""
+    while True:
+        time.sleep(ticker.wait())
+        start = time.monotonic()
+        if ticker.start(start):
+            yield dt.datetime.now()
+            ticker.finish(time.monotonic() - start)
+
+
+async def async_interval(
+    i: float, overrun: Overrun = Overrun.immediate
+) -> AsyncGenerator[dt.datetime, None]:
+    async for t in async_ticks(Ticker(i, overrun)):
+        yield t
+
+
+async def async_ticks(ticker: Ticker) -> AsyncGenerator[dt.datetime, None]:
     while True:
-        t1 = dt.datetime.now()
-        yield t1
-        t2 = dt.datetime.now()
-        wait = i - (t2 - t1).total_seconds()
-        if wait > 0:
-            time.sleep(wait)
+        await asyncio.sleep(ticker.wait())
+        start = time.monotonic()
+        if ticker.start(start):
+            yield dt.datetime.now()
+            ticker.finish(time.monotonic() - start)
+
+
+def run_every(
+    ticker: Ticker, f: Callable[[dt.datetime], None], max_concurrent: int = 1
+) -> NoReturn:
+    """Calls f at each tick, in threads, with up to max_concurrent calls at once.
+
+    A call only overruns if every slot is still busy at the following tick.
+    The first exception raised by a call is raised here, at the next tick.
+    """
+    slots = BoundedSemaphore(max_concurrent)
+    errors: List[BaseException] = []
+
+    def cycle(t: dt.datetime, start: float) -> None:
+        try:
+            f(t)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            ticker.finish(time.monotonic() - start)
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=max_concurrent) as pool:
+        while True:
+            time.sleep(ticker.wait())
+            slots.acquire()
+            if errors:
+                raise errors[0]
+            start = time.monotonic()
+            if ticker.start(start):
+                pool.submit(cycle, dt.datetime.now(), start)
+            else:
+                slots.release()
 
 
 def combine_dictionaries(xs: Dict[A, B], ys: Dict[A, B]) -> Dict[A, List[B]]:
@@ -9,12 +9,12 @@ from typing import Callable, Deque, Iterable, Iterator, List, Tuple
 import ipyleaflet as lf
 import pandas as pd
 
-import busboy.database as db
 import busboy.prediction as prediction
 from busboy.apis import Timetable, TimetableVariant
 from busboy.database import BusSnapshot
 from busboy.map.map import Map
-from busboy.util import Right, drop
+from busboy.reference import shared_reference_data
+from busboy.util import drop
 
 
 def snapshot_to_marker(entry: BusSnapshot) -> lf.Marker:
@@ -103,15 +103,7 @@ def show_timetables(map: Map, timetables: List[Timetable]) -> None:
 def read_preprocessed_data(
     route_name: str
 ) -> List[Tuple[TimetableVariant, pd.DataFrame]]:
-    rbn = db.routes_by_name()
-    route_id = rbn[route_name].id
-    timetables = db.timetables(route_id)
-    timetable_variants = {
-        t
-        for timetable in timetables
-        for t in timetable.value.variants
-        if isinstance(timetable, Right)
-    }
+    timetable_variants = shared_reference_data().variants(route_name)
     dfs = []
     with scandir("data") as dir:
         for entry in dir:
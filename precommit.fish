@@ -1,3 +1,4 @@
 #!/usr/bin/env fish
 pipenv run isort **.py **.pyi
 pipenv run black **.py **.pyi
+pipenv run python -m busboy.decoding
@@ -0,0 +1,61 @@
+-- The schema as it was before migrations were versioned. Everything is created
+-- only if it doesn’t exist, so this is a no-op on existing databases.
+
+create table if not exists passage_responses (
+        route_id varchar(30),
+        direction smallint,
+        vehicle_id varchar(30),
+        last_modified timestamp,
+        trip_id varchar(30),
+        congestion_level smallint,
+        accuracy_level smallint,
+        status smallint,
+        is_accessible boolean,
+        latitude integer,
+        longitude integer,
+        bearing integer,
+        pattern_id varchar(30),
+        has_bike_rack boolean,
+        category smallint,
+        primary key (trip_id, last_modified)
+);
+
+create table if not exists routes (
+        id varchar(30) primary key,
+        name varchar(20),
+        direction smallint,
+        number integer,
+        category smallint
+);
+
+create table if not exists stops (
+        id varchar(30) primary key,
+        name varchar(50),
+        number integer,
+        latitude double precision,
+        longitude double precision
+);
+
+create table if not exists timetables (
+        id int generated always as identity primary key,
+        caption text
+);
+
+create table if not exists route_timetables (
+        route varchar(30) references routes(id),
+        timetable int references timetables(id),
+        primary key (route, timetable)
+);
+
+create table if not exists timetable_variants (
+        id int generated always as identity primary key,
+        route_name varchar(10),
+        timetable_id int references timetables(id)
+);
+
+create table if not exists variant_stops (
+        position int,
+        variant int references timetable_variants(id),
+        stop varchar(30) references stops(id),
+        primary key (variant, position)
+);
@@ -0,0 +1,4 @@
+-- The time of the poll each passage was recorded in, which store_trips has
+-- always written but the schema never declared.
+
+alter table passage_responses add column if not exists poll_time timestamp;
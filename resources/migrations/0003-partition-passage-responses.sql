@@ -0,0 +1,67 @@
+-- Partitions passage_responses by month of last_modified, so that queries for a
+-- day or a span of days only read the months they cover, and indexes it for the
+-- queries in busboy/database.py:
+--
+-- - snapshots and trips_on_day filter on route_id and a last_modified range;
+-- - snapshots without a route filter on the last_modified range alone, which
+--   a small BRIN index handles well since rows arrive in time order;
+-- - poll_times_df lists the distinct poll_times in order;
+-- - trip_points looks up a trip_id, which the primary key covers.
+--
+-- Existing rows are moved to passage_responses_unpartitioned, and copied back
+-- a month at a time by `python -m busboy.migrations copy`, so that each month
+-- is its own transaction. Needs PostgreSQL 11 or later.
+
+alter table passage_responses rename to passage_responses_unpartitioned;
+alter index passage_responses_pkey rename to passage_responses_unpartitioned_pkey;
+
+create table passage_responses (
+        route_id varchar(30),
+        direction smallint,
+        vehicle_id varchar(30),
+        last_modified timestamp,
+        trip_id varchar(30),
+        congestion_level smallint,
+        accuracy_level smallint,
+        status smallint,
+        is_accessible boolean,
+        latitude integer,
+        longitude integer,
+        bearing integer,
+        pattern_id varchar(30),
+        has_bike_rack boolean,
+        category smallint,
+        poll_time timestamp,
+        primary key (trip_id, last_modified)
+) partition by range (last_modified);
+
+create index passage_responses_route_last_modified
+        on passage_responses (route_id, last_modified);
+create index passage_responses_last_modified
+        on passage_responses using brin (last_modified);
+create index passage_responses_poll_time
+        on passage_responses (poll_time);
+
+-- Catches rows outside every monthly partition, rather than failing to insert
+-- them. A month can’t be given its own partition while this holds rows for it.
+create table passage_responses_default partition of passage_responses default;
+
+-- Creates the monthly partitions covering first to last, if they don’t exist.
+create function create_passage_partitions(first date, last date) returns void as $$
+declare
+        month date := date_trunc('month', first);
+begin
+        while month <= last loop
+                execute format(
+                        'create table if not exists %I partition of passage_responses '
+                        'for values from (%L) to (%L)',
+                        'passage_responses_' || to_char(month, 'YYYY_MM'),
+                        month,
+                        month + interval '1 month'
+                );
+                month := month + interval '1 month';
+        end loop;
+end
+$$ language plpgsql;
+
+select create_passage_partitions(current_date, current_date + 62);
@@ -0,0 +1,43 @@
+-- Lets create_passage_partitions create a month that already has rows in the
+-- default partition, as happens if the collector stores passages for a month
+-- before its partition exists. PostgreSQL won’t create a partition for rows
+-- the default partition holds, so each missing month is now created as a
+-- standalone table, given the month’s rows from the default partition, and
+-- then attached, all in the caller’s transaction.
+
+create or replace function create_passage_partitions(first date, last date)
+returns void as $$
+declare
+        month date := date_trunc('month', first);
+        name text;
+begin
+        while month <= last loop
+                name := 'passage_responses_' || to_char(month, 'YYYY_MM');
+                if to_regclass(name) is null then
+                        execute format(
+                                'create table %I (like passage_responses '
+                                'including defaults including constraints)',
+                                name
+                        );
+                        execute format(
+                                'with moved as ('
+                                'delete from passage_responses_default '
+                                'where last_modified >= %L and last_modified < %L '
+                                'returning *) '
+                                'insert into %I select * from moved',
+                                month,
+                                month + interval '1 month',
+                                name
+                        );
+                        execute format(
+                                'alter table passage_responses attach partition %I '
+                                'for values from (%L) to (%L)',
+                                name,
+                                month,
+                                month + interval '1 month'
+                        );
+                end if;
+                month := month + interval '1 month';
+        end loop;
+end
+$$ language plpgsql;
@@ -4,7 +4,10 @@ from bs4.element import Tag
 
 class BeautifulSoup(Tag):
     def __init__(
-        self, markup: str = "", features: Optional[str] = None, **kwargs: Any
+        self,
+        markup: Union[str, bytes] = "",
+        features: Optional[str] = None,
+        **kwargs: Any
     ) -> None: ...
 
 class ResultSet(List[Tag]): ...
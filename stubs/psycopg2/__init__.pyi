@@ -4,4 +4,5 @@ import psycopg2.extensions as x
 
 def connect(s: str = ..., dbname: str = ..., user: str = ...) -> x.connection: ...
 
-class IntegrityError(object): ...
+class Error(Exception): ...
+class IntegrityError(Error): ...
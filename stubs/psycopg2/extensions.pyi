@@ -1,17 +1,35 @@
-from typing import *
+from typing import IO, Any, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+TRANSACTION_STATUS_IDLE: int
+TRANSACTION_STATUS_ACTIVE: int
+TRANSACTION_STATUS_INTRANS: int
+TRANSACTION_STATUS_INERROR: int
+TRANSACTION_STATUS_UNKNOWN: int
 
 class cursor:
+    itersize: int
+    rowcount: int
     def __enter__(self, *args: Any) -> cursor: ...
     def __exit__(self, *args: Any) -> None: ...
     def mogrify(self, query: Union[str, bytes], items: Tuple[Any, ...]) -> bytes: ...
-    def execute(self, query: Union[str, bytes], values: List[Any] = ...) -> None: ...
+    def execute(
+        self,
+        query: Union[str, bytes],
+        values: Union[Sequence[Any], Mapping[str, Any]] = ...,
+    ) -> None: ...
     def fetchall(self) -> Iterable[Tuple[Any, ...]]: ...
+    def fetchmany(self, size: int = ...) -> List[Tuple[Any, ...]]: ...
     def fetchone(self) -> Optional[Tuple[Any, ...]]: ...
+    def copy_expert(self, sql: str, file: IO[Any], size: int = ...) -> None: ...
 
 _cursor = cursor
 
 class connection:
+    closed: int
     def __enter__(self, *args: Any) -> connection: ...
     def __exit__(self, *args: Any) -> None: ...
     def close(self) -> None: ...
-    def cursor(self) -> _cursor: ...
+    def commit(self) -> None: ...
+    def rollback(self) -> None: ...
+    def get_transaction_status(self) -> int: ...
+    def cursor(self, name: Optional[str] = None) -> _cursor: ...
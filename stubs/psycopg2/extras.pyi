@@ -0,0 +1,11 @@
+from typing import Any, Iterable, Optional, Sequence, Union
+
+from psycopg2.extensions import cursor
+
+def execute_values(
+    cur: cursor,
+    sql: Union[str, bytes],
+    argslist: Iterable[Sequence[Any]],
+    template: Optional[str] = None,
+    page_size: int = 100,
+) -> None: ...
@@ -0,0 +1,16 @@
+from typing import Any
+
+from psycopg2.extensions import connection
+
+class PoolError(Exception): ...
+
+class AbstractConnectionPool(object):
+    closed: bool
+    def __init__(self, minconn: int, maxconn: int, *args: Any, **kwargs: Any): ...
+    def getconn(self, key: Any = None) -> connection: ...
+    def putconn(
+        self, conn: connection, key: Any = None, close: bool = False
+    ) -> None: ...
+    def closeall(self) -> None: ...
+
+class ThreadedConnectionPool(AbstractConnectionPool): ...